@@ -0,0 +1,84 @@
+# auth.py
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject, User
+
+from config import config
+from database import Database, db
+
+logger = logging.getLogger(__name__)
+
+UNAUTHORIZED_TEXT = "Пожалуйста, сначала пройдите авторизацию. Отправьте команду /start."
+
+
+class AuthCache:
+    """
+    Авторизованные пользователи в памяти. Заполняется из таблицы users при старте
+    и пополняется через authorize_user, поэтому проверка доступа не ходит в БД.
+    Неизвестных пользователей проверяем в БД один раз и запоминаем отказ;
+    таких записей не больше max_negative, самые давние вытесняются.
+    """
+    def __init__(self, database: Database, max_negative: int):
+        self._db = database
+        self.max_negative = max_negative
+        self._authorized: Set[int] = set()
+        self._negative: "OrderedDict[int, None]" = OrderedDict()
+
+    async def warm(self):
+        self._authorized = set(await self._db.get_authorized_user_ids())
+        self._negative.clear()
+        logger.info(f"Auth cache warmed with {len(self._authorized)} users")
+
+    async def is_authorized(self, user_id: int) -> bool:
+        if user_id in self._authorized:
+            return True
+        if user_id in self._negative:
+            self._negative.move_to_end(user_id)
+            return False
+        authorized = await self._db.is_user_authorized(user_id)
+        if authorized:
+            self._authorized.add(user_id)
+        else:
+            self._negative[user_id] = None
+            if len(self._negative) > self.max_negative:
+                self._negative.popitem(last=False)
+        return authorized
+
+    async def authorize_user(self, user_id: int):
+        await self._db.authorize_user(user_id)
+        self._authorized.add(user_id)
+        self._negative.pop(user_id, None)
+
+
+class AuthMiddleware(BaseMiddleware):
+    """
+    Кладет в data["is_authorized"] результат проверки по кэшу.
+    Обработчики с флагом authorized=True для неавторизованных не вызываются.
+    """
+    def __init__(self, cache: AuthCache):
+        self.cache = cache
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user: Optional[User] = data.get("event_from_user")
+        is_authorized = user is not None and await self.cache.is_authorized(user.id)
+        data["is_authorized"] = is_authorized
+
+        if not is_authorized and get_flag(data, "authorized"):
+            if isinstance(event, Message):
+                await event.answer(UNAUTHORIZED_TEXT)
+            elif isinstance(event, CallbackQuery):
+                await event.answer(UNAUTHORIZED_TEXT, show_alert=True)
+            return None
+        return await handler(event, data)
+
+
+auth_cache = AuthCache(db, config.auth_negative_cache_size)
@@ -0,0 +1,157 @@
+# benchmarks/bench_decode.py
+"""
+Микробенчмарк разбора снимка и рендера сообщений.
+
+"До": очередь остается списком JSON-словарей, каждое сообщение заново разбирает
+даты через strptime + localize (так работал format_car_info раньше).
+"После": снимок один раз декодируется в QueueCar, рендер работает с unix-временем.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_decode.py [--cars 10000] [--repeat 5]
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# config требует токен бота, для бенчмарка подойдет любой
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+
+from config import config  # noqa: E402
+from queue_model import DATE_FORMAT, TIMEZONE, decode_queue, format_queue_time, parse_queue_time  # noqa: E402
+from services import QueueSnapshot, format_car_info  # noqa: E402
+
+STATUS_MAP = {1: "Аннулирован", 2: "Прибыл в ЗО", 3: "Вызван в ПП"}
+
+
+def legacy_format_car_info(user_car_data, total_cars, first_car_overall=None, first_waiting_car=None) -> str:
+    """Прежний рендер: разбор дат из строк на каждое сообщение."""
+    info_text = f"🚗 **Всего машин в очереди: {total_cars}**\n\n"
+    user_status_text = STATUS_MAP.get(user_car_data['status'], "Неизвестный статус")
+    user_reg_time = TIMEZONE.localize(datetime.datetime.strptime(user_car_data['registration_date'], DATE_FORMAT))
+    info_text += (
+        f"🚙 **Ваш авто:** `{user_car_data['regnum']}`\n"
+        f"🚦 **Статус:** *{user_status_text}*\n"
+    )
+    if user_car_data['status'] == 3:
+        changed_time = TIMEZONE.localize(datetime.datetime.strptime(user_car_data['changed_date'], DATE_FORMAT))
+        info_text += f"⏱ **Время ожидания (до вызова):** `{str(changed_time - user_reg_time).split('.')[0]}`\n"
+    else:
+        wait_time = datetime.datetime.now(TIMEZONE) - user_reg_time
+        info_text += (
+            f"📍 **Позиция в очереди:** `{user_car_data['order_id']}`\n"
+            f"📅 **Зарегистрирован:** `{user_reg_time.strftime(DATE_FORMAT)}`\n"
+            f"⏳ **В очереди уже:** `{str(wait_time).split('.')[0]}`\n"
+        )
+    if first_car_overall and first_car_overall.get('regnum') != user_car_data.get('regnum'):
+        info_text += "\n---\n"
+        reg_time = TIMEZONE.localize(datetime.datetime.strptime(first_car_overall['registration_date'], DATE_FORMAT))
+        changed_time = TIMEZONE.localize(datetime.datetime.strptime(first_car_overall['changed_date'], DATE_FORMAT))
+        info_text += (
+            f"**🔝 Вызван в ПП:** `{first_car_overall['regnum']}`\n"
+            f"⏱ **Время в очереди:** `{str(changed_time - reg_time).split('.')[0]}`\n"
+            f"📅 **Зарегистрирован:** `{reg_time.strftime(DATE_FORMAT)}`\n"
+            f"🔔 **Вызван:** `{changed_time.strftime(DATE_FORMAT)}`\n"
+        )
+    if first_waiting_car and first_waiting_car.get('regnum') != user_car_data.get('regnum'):
+        info_text += "---\n"
+        reg_time = TIMEZONE.localize(datetime.datetime.strptime(first_waiting_car['registration_date'], DATE_FORMAT))
+        wait_time = datetime.datetime.now(TIMEZONE) - reg_time
+        info_text += (
+            f"👑 **Следующий на вызов:** `{first_waiting_car['regnum']}`\n"
+            f"⏳ **Ожидает уже:** `{str(wait_time).split('.')[0]}`\n"
+            f"📅 **Зарегистрирован:** `{reg_time.strftime(DATE_FORMAT)}`\n"
+        )
+    return info_text
+
+
+def make_raw_queue(count: int):
+    """Очередь как в carLiveQueue: несколько вызванных машин в начале, регистрация раз в ~20 секунд."""
+    now = datetime.datetime.now(TIMEZONE).replace(tzinfo=None)
+    queue = []
+    for i in range(count):
+        registered = now - datetime.timedelta(seconds=(count - i) * 20 + random.randint(0, 19))
+        status = 3 if i < 10 else 2
+        changed = now - datetime.timedelta(minutes=10 - i) if status == 3 else registered
+        queue.append({
+            "regnum": f"AB{i:05d}",
+            "order_id": i + 1,
+            "status": status,
+            "registration_date": registered.strftime(DATE_FORMAT),
+            "changed_date": changed.strftime(DATE_FORMAT),
+        })
+    return queue
+
+
+def measure(fn, repeat: int) -> float:
+    """Лучшее время из repeat запусков, в миллисекундах."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cars", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    raw = make_raw_queue(args.cars)
+    total = len(raw)
+    first_raw = raw[0]
+    waiting_raw = next(c for c in raw if c["status"] != 3)
+
+    def legacy_parse():
+        # Раньше снимок не декодировался, только строился индекс по номеру
+        return {car["regnum"]: car for car in raw}
+
+    def legacy_render():
+        for car in raw:
+            legacy_format_car_info(car, total, first_raw, waiting_raw)
+
+    def cold_decode():
+        parse_queue_time.cache_clear()
+        format_queue_time.cache_clear()
+        cars = decode_queue(raw)
+        return {car.regnum: car for car in cars}
+
+    def warm_decode():
+        cars = decode_queue(raw)
+        return {car.regnum: car for car in cars}
+
+    cars = decode_queue(raw)
+    first_car = cars[0]
+    waiting_car = next(c for c in cars if not c.is_called)
+
+    def new_render():
+        for car in cars:
+            format_car_info(car, total, first_car, waiting_car)
+
+    def snapshot_render():
+        # Общие блоки рендерятся один раз на снимок, дальше только личная часть
+        snapshot = QueueSnapshot(config.checkpoints[0], cars)
+        for car in cars:
+            snapshot.format_car_info(car)
+
+    scale = 10000 / total
+    rows = [
+        ("before: index dicts", measure(legacy_parse, args.repeat)),
+        ("before: render (strptime)", measure(legacy_render, args.repeat)),
+        ("after: decode (cold cache)", measure(cold_decode, args.repeat)),
+        ("after: decode (warm cache)", measure(warm_decode, args.repeat)),
+        ("after: render (QueueCar)", measure(new_render, args.repeat)),
+        ("after: render (snapshot)", measure(snapshot_render, args.repeat)),
+    ]
+    print(f"{total} cars, best of {args.repeat}, ms per 10k cars")
+    for name, ms in rows:
+        print(f"  {name:<28} {ms * scale:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
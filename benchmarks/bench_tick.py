@@ -0,0 +1,226 @@
+# benchmarks/bench_tick.py
+"""
+Нагрузочный прогон без сети: локальный фейковый API погранперехода, фейковый Telegram,
+настоящие services.scheduled_job, handlers.handle_my_cars и Database (SQLite во временной папке).
+
+Для каждого тика планировщика и для запросов /mycars печатает перцентили задержки,
+число запросов к API, SQL-запросов и вызовов Bot API.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_tick.py --preset medium
+    python benchmarks/bench_tick.py --queue-size 20000 --tracked 10000 --ticks 20 --retry-after-every 500
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_border_api import FakeBorderApi  # noqa: E402
+from fake_telegram import RecordingSession, make_bot  # noqa: E402
+
+PRESETS = {
+    "small": dict(queue_size=100, tracked=10, cars_per_user=1, ticks=20, mycars_requests=10),
+    "medium": dict(queue_size=5000, tracked=1000, cars_per_user=2, ticks=20, mycars_requests=200),
+    "large": dict(queue_size=20000, tracked=10000, cars_per_user=5, ticks=10, mycars_requests=1000),
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def print_latency(title: str, latencies_ms: List[float]):
+    print(
+        f"{title}: n={len(latencies_ms)} p50={percentile(latencies_ms, 50):.1f}ms "
+        f"p90={percentile(latencies_ms, 90):.1f}ms p99={percentile(latencies_ms, 99):.1f}ms "
+        f"max={max(latencies_ms, default=0):.1f}ms"
+    )
+
+
+def configure_environment(api_url: str, workdir: str, live_cards: bool):
+    """Настройки бота для прогона; должны быть заданы до импорта config."""
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "0:benchmark",
+        "BORDER_API_URL": api_url,
+        "HISTORY_DB_NAME": os.path.join(workdir, "history.db"),
+        # Каждый тик должен видеть новый снимок
+        "POLL_MIN_INTERVAL_SECONDS": "0",
+        "SNAPSHOT_TTL_SECONDS": "0",
+        # Лимиты Telegram в прогоне не нужны: считаем сообщения, а не ждем их
+        "OUTBOX_GLOBAL_RATE": "1000000",
+        "OUTBOX_CHAT_RATE": "1000000",
+        "OUTBOX_CHAT_BURST": "1000000",
+        "LIVE_CARDS": "1" if live_cards else "0",
+    })
+    os.environ.pop("CHECKPOINTS", None)
+    os.chdir(workdir)
+
+
+async def drain_outbox(services):
+    """Ждет, пока воркеры отправят все, что тик поставил в очередь, и фоновые задачи карточек."""
+    await services.outbox._queue.join()
+    while services._card_tasks:
+        await asyncio.gather(*services._card_tasks)
+
+
+async def run(args):
+    api = FakeBorderApi(
+        args.queue_size, change_every=args.change_every, etag=args.etag,
+        cars_per_hour=args.cars_per_hour, step_seconds=args.step_seconds, seed=1
+    )
+    api_url = await api.start()
+    workdir = tempfile.mkdtemp(prefix="border-bench-")
+    configure_environment(api_url, workdir, args.live_cards)
+
+    # Модули бота импортируются только после настройки окружения
+    from aiogram import Dispatcher
+    from aiogram.types import Update
+
+    import handlers
+    import services
+    from auth import auth_cache
+    from config import config
+    from database import db
+
+    checkpoint = config.checkpoints[0]
+    session = RecordingSession(args.retry_after_every)
+    bot = make_bot(session)
+    dp = Dispatcher()
+    dp.include_router(handlers.router)
+
+    sql_statements = 0
+
+    def count_statement(_sql: str):
+        nonlocal sql_statements
+        sql_statements += 1
+
+    await db.initialize(checkpoint.id)
+    await db.conn.set_trace_callback(count_statement)
+    await services.api_client.start()
+    await services.history.start()
+    services.outbox.start(bot)
+
+    try:
+        # Отслеживаемые машины равномерно по очереди, чтобы были и близкие к вызову, и далекие
+        regnums = api.queue(checkpoint.id).regnums()
+        step = max(1, len(regnums) // max(1, args.tracked))
+        tracked = regnums[::step][:args.tracked]
+        users: Dict[int, List[str]] = {}
+        for i, regnum in enumerate(tracked):
+            users.setdefault(1000 + i // args.cars_per_user, []).append(regnum)
+        for user_id, car_numbers in users.items():
+            await auth_cache.authorize_user(user_id)
+            await db.add_cars(user_id, checkpoint.id, car_numbers)
+        snapshot = await services.fetch_snapshot(checkpoint)
+        updates = services.CarUpdates(checkpoint.id)
+        for regnum in tracked:
+            car = snapshot.find(regnum)
+            if car is not None:
+                updates.update_state(regnum, car.order_id, car.status)
+        await updates.apply()
+        print(
+            f"queue={args.queue_size} tracked={len(tracked)} users={len(users)} "
+            f"live_cards={args.live_cards} retry_after_every={args.retry_after_every} "
+            f"change_every={args.change_every} etag={args.etag}"
+        )
+
+        # Тики планировщика
+        tick_ms, api_calls, statements, messages = [], [], [], []
+        skipped_before = services.CHECKS.value(checkpoint=checkpoint.name, result="skipped")
+        for _ in range(args.ticks):
+            api_before, sql_before = api.requests, sql_statements
+            session.reset()
+            started = time.perf_counter()
+            await services.scheduled_job()
+            tick_ms.append((time.perf_counter() - started) * 1000)
+            await drain_outbox(services)
+            api_calls.append(api.requests - api_before)
+            statements.append(sql_statements - sql_before)
+            messages.append(session.counts())
+
+        print_latency("scheduled_job", tick_ms)
+        sent = [counts.get("SendMessage", 0) for counts in messages]
+        edited = [counts.get("EditMessageText", 0) for counts in messages]
+        print(
+            f"  per tick: api_calls={sum(api_calls) / len(api_calls):.1f} "
+            f"sql={sum(statements) / len(statements):.1f} "
+            f"sent={sum(sent) / len(sent):.1f} edited={sum(edited) / len(edited):.1f} "
+            f"(max sent {max(sent)}, max edited {max(edited)})"
+        )
+        skipped = services.CHECKS.value(checkpoint=checkpoint.name, result="skipped") - skipped_before
+        print(f"  skipped ticks: {skipped:.0f}/{args.ticks} (304 responses: {api.not_modified})")
+
+        # /mycars от разных пользователей одновременно
+        user_ids = list(users)[:args.mycars_requests]
+        api_before, sql_before = api.requests, sql_statements
+        session.reset()
+        latencies = []
+
+        async def my_cars(n: int, user_id: int):
+            update = Update.model_validate({
+                "update_id": n,
+                "message": {
+                    "message_id": n, "date": 0, "text": "/mycars",
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+                },
+            })
+            started = time.perf_counter()
+            await dp.feed_update(bot, update)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        # Ошибка одного обработчика не должна обрывать замер: считаем такие запросы отдельно
+        results = await asyncio.gather(
+            *(my_cars(n, user_id) for n, user_id in enumerate(user_ids, start=1)), return_exceptions=True
+        )
+        failures = Counter(type(result).__name__ for result in results if isinstance(result, BaseException))
+        await drain_outbox(services)
+        print_latency("handle_my_cars", latencies)
+        counts = session.counts()
+        print(
+            f"  total: api_calls={api.requests - api_before} sql={sql_statements - sql_before} "
+            f"sent={counts.get('SendMessage', 0)} retry_after={session.retry_afters} "
+            f"failed={sum(failures.values())}{' ' + str(dict(failures)) if failures else ''}"
+        )
+    finally:
+        await services.outbox.stop()
+        await services.history.stop()
+        await services.api_client.close()
+        await db.close()
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--queue-size", type=int)
+    parser.add_argument("--tracked", type=int)
+    parser.add_argument("--cars-per-user", type=int)
+    parser.add_argument("--ticks", type=int)
+    parser.add_argument("--mycars-requests", type=int)
+    parser.add_argument("--cars-per-hour", type=float, default=60.0)
+    parser.add_argument("--step-seconds", type=float, default=60.0)
+    parser.add_argument("--retry-after-every", type=int, default=0, help="каждый N-й вызов Telegram получает RetryAfter")
+    parser.add_argument("--no-live-cards", dest="live_cards", action="store_false")
+    parser.add_argument("--change-every", type=int, default=1, help="очередь меняется на каждом N-м запросе к API")
+    parser.add_argument("--etag", action="store_true", help="фейковый API поддерживает ETag и 304")
+    args = parser.parse_args()
+    for key, value in PRESETS[args.preset].items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
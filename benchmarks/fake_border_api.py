@@ -0,0 +1,182 @@
+# benchmarks/fake_border_api.py
+"""
+Локальная имитация эндпоинта belarusborder.by/info/monitoring-new.
+
+Очередь каждого пункта пропуска живет во времени: на каждый запрос модельное время
+сдвигается на step_seconds, из начала очереди машины вызываются в ПП (status 3),
+давно вызванные уходят, в конец приезжают новые. Размер очереди держится около queue_size.
+
+Можно запустить отдельно и направить на него бота через BORDER_API_URL:
+    python benchmarks/fake_border_api.py --port 8081 --cars 5000
+    BORDER_API_URL=http://127.0.0.1:8081/info/monitoring-new python bot.py
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import random
+from typing import Dict, List, Optional
+
+import pytz
+from aiohttp import web
+
+# Время в API - местное время пунктов пропуска
+TIMEZONE = pytz.timezone("Europe/Minsk")
+DATE_FORMAT = "%H:%M:%S %d.%m.%Y"
+API_PATH = "/info/monitoring-new"
+
+
+class FakeQueue:
+    """Очередь одного пункта пропуска в модельном времени."""
+    def __init__(
+        self,
+        queue_size: int,
+        cars_per_hour: float = 60.0,
+        step_seconds: float = 60.0,
+        called_kept: int = 10,
+        seed: Optional[int] = None
+    ):
+        self.queue_size = queue_size
+        self.cars_per_hour = cars_per_hour
+        self.step_seconds = step_seconds
+        self.called_kept = called_kept
+        self._random = random.Random(seed)
+        self._now = datetime.datetime.now(TIMEZONE).replace(tzinfo=None, microsecond=0)
+        self._serial = 0
+        self._carry = 0.0
+        # Каждая машина: [regnum, status, registration_date, changed_date]
+        self.cars: List[list] = []
+        interval = 3600 / cars_per_hour
+        for i in range(queue_size):
+            registered = self._now - datetime.timedelta(seconds=(queue_size - i) * interval)
+            self.cars.append(self._new_car(registered))
+        for car in self.cars[:called_kept]:
+            self._call(car, self._now - datetime.timedelta(minutes=self._random.randint(1, 30)))
+
+    def _new_car(self, registered: datetime.datetime) -> list:
+        self._serial += 1
+        return [f"{self._serial:04d}AB{self._serial % 7 + 1}", 2, registered, registered]
+
+    def _call(self, car: list, at: datetime.datetime):
+        car[1] = 3
+        car[3] = at
+
+    def regnums(self) -> List[str]:
+        return [car[0] for car in self.cars]
+
+    def advance(self):
+        """Сдвигает модельное время на один шаг."""
+        self._now += datetime.timedelta(seconds=self.step_seconds)
+        self._carry += self.cars_per_hour * self.step_seconds / 3600
+        moves, self._carry = int(self._carry), self._carry - int(self._carry)
+
+        waiting = [car for car in self.cars if car[1] != 3]
+        for car in waiting[:moves]:
+            self._call(car, self._now)
+        # Вызванные машины проезжают и пропадают из списка
+        called = [car for car in self.cars if car[1] == 3]
+        gone = {id(car) for car in called[:max(0, len(called) - self.called_kept)]}
+        self.cars = [car for car in self.cars if id(car) not in gone]
+        # Иногда кто-то аннулирует запись
+        if waiting and self._random.random() < 0.05:
+            self.cars.remove(self._random.choice(waiting[moves:] or waiting))
+        while len(self.cars) < self.queue_size:
+            self.cars.append(self._new_car(self._now))
+
+    def payload(self) -> Dict:
+        queue = []
+        for order_id, (regnum, status, registered, changed) in enumerate(self.cars, start=1):
+            queue.append({
+                "regnum": regnum,
+                "status": status,
+                "order_id": order_id,
+                "registration_date": registered.strftime(DATE_FORMAT),
+                "changed_date": changed.strftime(DATE_FORMAT),
+            })
+        return {"carLiveQueue": queue}
+
+
+class FakeBorderApi:
+    """
+    aiohttp-приложение с очередями по checkpointId и счетчиком запросов.
+    change_every: очередь сдвигается на каждом N-м запросе, между ними ответ не меняется.
+    etag: отдавать ETag и отвечать 304 на If-None-Match с тем же значением.
+    """
+    def __init__(
+        self,
+        queue_size: int,
+        advance_on_request: bool = True,
+        change_every: int = 1,
+        etag: bool = False,
+        **queue_kwargs
+    ):
+        self.queue_size = queue_size
+        self.advance_on_request = advance_on_request
+        self.change_every = max(1, change_every)
+        self.etag = etag
+        self.queue_kwargs = queue_kwargs
+        self.queues: Dict[str, FakeQueue] = {}
+        self.requests = 0
+        self.not_modified = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    def queue(self, checkpoint_id: str) -> FakeQueue:
+        queue = self.queues.get(checkpoint_id)
+        if queue is None:
+            queue = self.queues[checkpoint_id] = FakeQueue(self.queue_size, **self.queue_kwargs)
+        return queue
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        queue = self.queue(request.query.get("checkpointId", ""))
+        if self.advance_on_request and self.requests % self.change_every == 0:
+            queue.advance()
+        body = json.dumps(queue.payload()).encode()
+        if not self.etag:
+            return web.Response(body=body, content_type="application/json")
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(body=body, content_type="application/json", headers={"ETag": etag})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(API_PATH, self.handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер и возвращает URL для BORDER_API_URL."""
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"http://{host}:{port}{API_PATH}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--cars", type=int, default=1000)
+    parser.add_argument("--cars-per-hour", type=float, default=60.0)
+    parser.add_argument("--step-seconds", type=float, default=60.0)
+    parser.add_argument("--change-every", type=int, default=1)
+    parser.add_argument("--etag", action="store_true")
+    args = parser.parse_args()
+
+    api = FakeBorderApi(
+        args.cars, change_every=args.change_every, etag=args.etag,
+        cars_per_hour=args.cars_per_hour, step_seconds=args.step_seconds
+    )
+    web.run_app(api.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# benchmarks/fake_telegram.py
+"""
+Сессия aiogram без сети: запоминает все вызовы Bot API и может имитировать
+флуд-контроль Telegram (TelegramRetryAfter) на каждом N-м сообщении.
+"""
+import itertools
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, SendMessage, TelegramMethod
+
+
+class RecordingSession(BaseSession):
+    """
+    retry_after_every: каждый N-й send_message/edit_message_text получает RetryAfter
+    на retry_after секунд (0 - никогда).
+    """
+    def __init__(self, retry_after_every: int = 0, retry_after: int = 1):
+        super().__init__()
+        self.retry_after_every = retry_after_every
+        self.retry_after = retry_after
+        self.calls: List[Tuple[float, TelegramMethod]] = []
+        self.retry_afters = 0
+        self._message_ids = itertools.count(1)
+        self._attempts = 0
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        if isinstance(method, (SendMessage, EditMessageText)):
+            self._attempts += 1
+            if self.retry_after_every and self._attempts % self.retry_after_every == 0:
+                self.retry_afters += 1
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=self.retry_after)
+        self.calls.append((time.monotonic(), method))
+        if isinstance(method, SendMessage):
+            # Вызывающему коду нужен только message_id
+            return SimpleNamespace(message_id=next(self._message_ids), chat=SimpleNamespace(id=method.chat_id))
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+    def counts(self) -> Counter:
+        """Сколько раз вызван каждый метод Bot API."""
+        return Counter(type(method).__name__ for _, method in self.calls)
+
+    def reset(self):
+        self.calls.clear()
+        self.retry_afters = 0
+
+
+def make_bot(session: RecordingSession) -> Bot:
+    return Bot(token="0:benchmark", session=session)
@@ -0,0 +1,177 @@
+# benchmarks/replay_updates.py
+"""
+Отправляет записанные обновления Telegram на webhook-эндпоинт бота (WEBHOOK=1).
+
+Файл - JSON Lines, по одному Update на строку, или сохраненный ответ getUpdates
+({"ok": true, "result": [...]}). update_id перенумеровываются, --repeat размножает
+записи на разных пользователей (user_id + номер повтора * 1000000).
+
+Против запущенного бота:
+    WEBHOOK=1 WEBHOOK_SECRET=s python bot.py
+    python benchmarks/replay_updates.py benchmarks/updates_sample.jsonl --secret s
+
+Полностью локально (--serve): в этом же процессе поднимаются фейковый API погранперехода,
+фейковый Telegram и WebhookServer с настоящими обработчиками; печатается, сколько
+ответов бот отправил бы в Telegram.
+    python benchmarks/replay_updates.py benchmarks/updates_sample.jsonl --serve --repeat 100
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_tick import configure_environment, percentile  # noqa: E402
+from fake_border_api import FakeBorderApi  # noqa: E402
+from fake_telegram import RecordingSession, make_bot  # noqa: E402
+
+SERVE_SECRET = "replay-secret"
+SERVE_USER_TOKEN = "demo"
+
+
+def load_updates(path: str) -> List[Dict]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("{\"ok\""):
+        return json.loads(text)["result"]
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def _shift_user(value, offset: int):
+    """Сдвигает id пользователей и чатов во всем обновлении, чтобы повторы шли от разных людей."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "id" and isinstance(item, int) and ("first_name" in value or "type" in value):
+                value[key] = item + offset
+            else:
+                _shift_user(item, offset)
+    elif isinstance(value, list):
+        for item in value:
+            _shift_user(item, offset)
+
+
+def expand_updates(updates: List[Dict], repeat: int) -> List[List[Dict]]:
+    """Списки обновлений по пользователям: внутри одного повтора порядок сохраняется."""
+    update_id = 1
+    streams = []
+    for n in range(repeat):
+        stream = []
+        for update in updates:
+            update = copy.deepcopy(update)
+            _shift_user(update, n * 1000000)
+            update["update_id"] = update_id
+            update_id += 1
+            stream.append(update)
+        streams.append(stream)
+    return streams
+
+
+async def replay(url: str, secret: str, streams: List[List[Dict]], concurrency: int, pause: float):
+    statuses: Counter = Counter()
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+
+    async with aiohttp.ClientSession() as session:
+        async def send_stream(stream: List[Dict]):
+            for update in stream:
+                async with semaphore:
+                    started = time.perf_counter()
+                    async with session.post(url, json=update, headers=headers) as response:
+                        statuses[response.status] += 1
+                    latencies.append((time.perf_counter() - started) * 1000)
+                # Как живой пользователь: следующее сообщение после паузы
+                if pause:
+                    await asyncio.sleep(pause)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send_stream(stream) for stream in streams))
+        elapsed = time.perf_counter() - started
+
+    print(
+        f"posted {len(latencies)} updates in {elapsed:.2f}s, statuses {dict(statuses)}, "
+        f"ack p50={percentile(latencies, 50):.1f}ms p99={percentile(latencies, 99):.1f}ms"
+    )
+
+
+async def serve_and_replay(args, streams: List[List[Dict]]):
+    api = FakeBorderApi(args.queue_size, seed=1)
+    api_url = await api.start()
+    configure_environment(api_url, tempfile.mkdtemp(prefix="border-replay-"), live_cards=True)
+    os.environ.update({
+        "VALID_USER_TOKENS": SERVE_USER_TOKEN,
+        "WEBHOOK_SECRET": SERVE_SECRET,
+        "WEBHOOK_PORT": "0",
+    })
+
+    # Модули бота импортируются только после настройки окружения
+    from aiogram import Dispatcher
+
+    import handlers
+    import services
+    from auth import auth_cache
+    from config import config
+    from database import db
+    from webhook import WebhookServer
+
+    session = RecordingSession()
+    bot = make_bot(session)
+    dp = Dispatcher()
+    dp.include_router(handlers.router)
+    await db.initialize(config.checkpoints[0].id)
+    await auth_cache.warm()
+    await services.api_client.start()
+    services.outbox.start(bot)
+    server = WebhookServer(
+        dp, bot, config.webhook_path, config.webhook_secret,
+        workers=config.webhook_workers, queue_size=config.webhook_queue_size
+    )
+    await server.start("127.0.0.1", 0)
+    port = server._runner.addresses[0][1]
+    try:
+        await replay(f"http://127.0.0.1:{port}{config.webhook_path}", SERVE_SECRET, streams, args.concurrency, args.pause)
+        started = time.perf_counter()
+        await server.join()
+        await services.outbox._queue.join()
+        print(f"processed the backlog {(time.perf_counter() - started) * 1000:.0f}ms after the last ack")
+        print(f"bot API calls: {dict(session.counts())}, border API calls: {api.requests}")
+    finally:
+        await server.stop()
+        await services.outbox.stop()
+        await services.api_client.close()
+        await db.close()
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("updates", help="JSON Lines с обновлениями или ответ getUpdates")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/telegram/webhook")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных POST-запросов")
+    parser.add_argument("--pause", type=float, default=0.0, help="пауза между сообщениями одного пользователя, с")
+    parser.add_argument("--serve", action="store_true", help="поднять бота с фейковыми API и Telegram в этом процессе")
+    parser.add_argument("--queue-size", type=int, default=1000, help="размер фейковой очереди для --serve")
+    args = parser.parse_args()
+
+    streams = expand_updates(load_updates(args.updates), args.repeat)
+    if args.serve:
+        asyncio.run(serve_and_replay(args, streams))
+    else:
+        asyncio.run(replay(args.url, args.secret, streams, args.concurrency, args.pause))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,128 @@
 # bot.py
+import argparse
 import asyncio
 import logging
-import pytz
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+import cluster
+from auth import auth_cache
 from config import config
 from database import db
 from handlers import router as main_router
-from services import scheduled_job
+from metrics import registry
+from scheduler import AdaptiveScheduler
+from services import api_client, history, outbox, scheduled_job
+from webhook import WebhookServer
 
-async def main():
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+async def serve_webhook(bot: Bot, dp: Dispatcher):
+    """Прием обновлений через webhook до SIGINT/SIGTERM; вебхук в Telegram при остановке не снимается."""
     logger = logging.getLogger(__name__)
-    
+    server = WebhookServer(
+        dp, bot, config.webhook_path, config.webhook_secret,
+        workers=config.webhook_workers, queue_size=config.webhook_queue_size
+    )
+    await server.start(config.webhook_host, config.webhook_port)
+    try:
+        if config.webhook_url:
+            await bot.set_webhook(
+                config.webhook_url,
+                secret_token=config.webhook_secret,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+            logger.info(f"Webhook зарегистрирован: {config.webhook_url}")
+        await cluster.wait_for_shutdown()
+    finally:
+        await server.stop()
+
+async def main(standalone: bool = True):
+    """
+    standalone=False - обработчик команд многопроцессного режима (cluster.py):
+    без планировщика и API, снимки очереди приходят от процесса-загрузчика.
+    """
+    logger = logging.getLogger(__name__)
+
     # Инициализация базы данных
-    await db.initialize()
+    await db.initialize(config.checkpoints[0].id)
     logger.info("База данных инициализирована.")
+    # Список авторизованных пользователей держим в памяти
+    await auth_cache.warm()
+
+    subscriber = None
+    if standalone:
+        # Один HTTP-клиент с пулом соединений на все время работы бота
+        await api_client.start()
+        await history.start()
+    else:
+        subscriber = cluster.SnapshotSubscriber(config.cluster_socket, track_throughput=True)
+        subscriber.start()
+        outbox.set_global_rate(config.outbox_global_rate / (config.notifier_shards + 1))
 
     # Инициализация бота и диспетчера
     bot = Bot(token=config.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
     dp = Dispatcher()
     dp.include_router(main_router)
 
-    # Настройка и запуск планировщика
-    scheduler = AsyncIOScheduler(timezone=pytz.timezone(config.timezone))
-    scheduler.add_job(scheduled_job, "interval", minutes=2, args=[bot])
-    scheduler.start()
-    logger.info("Планировщик запущен.")
+    # Очередь исходящих сообщений с лимитами Telegram
+    outbox.start(bot)
+
+    # Метрики отдаются из того же event loop
+    port = config.metrics_port if standalone else cluster.metrics_port(1)
+    if port:
+        await registry.start_server(config.metrics_host, port)
+
+    scheduler = None
+    if standalone:
+        # Настройка и запуск планировщика
+        # Интервал опроса подстраивается под движение очереди и близость отслеживаемых машин к вызову
+        scheduler = AdaptiveScheduler(scheduled_job, config.poll_min_interval, config.poll_max_interval)
+        scheduler.start()
+        logger.info("Планировщик запущен.")
 
     logger.info("Бот запускается...")
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        if config.webhook_enabled:
+            await serve_webhook(bot, dp)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
     finally:
-        scheduler.shutdown()
+        if scheduler is not None:
+            await scheduler.stop()
+        if subscriber is not None:
+            await subscriber.stop()
+        await registry.stop_server()
+        await outbox.stop()
+        await api_client.close()
+        await history.stop()
         await bot.session.close()
+        await db.close()
         logger.info("Бот остановлен.")
 
+def run(role: str, shard: int):
+    if role == "cluster":
+        return cluster.run_supervisor()
+    if role == "fetcher":
+        return cluster.run_fetcher()
+    if role == "notifier":
+        return cluster.run_notifier(shard)
+    return main(standalone=role == "single")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Telegram-бот очереди на погранпереходе")
+    parser.add_argument(
+        "--role", choices=["single", "cluster", "fetcher", "notifier", "dispatcher"],
+        help="по умолчанию cluster при NOTIFIER_SHARDS > 0, иначе single (все в одном процессе)"
+    )
+    parser.add_argument("--shard", type=int, default=0, help="номер доли пользователей для --role notifier")
+    args = parser.parse_args()
+    role = args.role or ("cluster" if config.notifier_shards > 0 else "single")
+
+    process_name = f"{role}-{args.shard}" if role == "notifier" else role
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s - {process_name} - %(levelname)s - %(name)s - %(message)s')
     try:
-        asyncio.run(main())
+        asyncio.run(run(role, args.shard))
     except (KeyboardInterrupt, SystemExit):
         logging.info("Бот остановлен вручную.")
\ No newline at end of file
@@ -0,0 +1,390 @@
+# cluster.py
+"""
+Многопроцессный режим на одной машине без внешнего брокера (NOTIFIER_SHARDS > 0).
+
+- fetcher: единственный процесс, который ходит в API; ведет планировщик, историю и
+  раздает каждый новый снимок очереди по Unix-сокету config.cluster_socket.
+- notifier: N процессов, каждый проверяет машины и рассылает уведомления своей доле
+  пользователей (user_id % N == shard) по снимкам от загрузчика.
+- dispatcher: aiogram long polling и обработчики команд (bot.main); снимки для ответов
+  тоже берет от загрузчика, поэтому тяжелая рассылка не задерживает ответы на команды.
+
+Супервизор (run_supervisor) запускает все процессы через bot.py и перезапускает упавшие.
+"""
+import asyncio
+import logging
+import marshal
+import os
+import signal
+import struct
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+
+import services
+from config import config
+from database import db
+from metrics import PhaseTimer, registry
+from queue_model import QueueCar
+from scheduler import AdaptiveScheduler, TickReport
+from services import QueueSnapshot, UserShard
+from snapshot_cache import SnapshotCache
+
+logger = logging.getLogger(__name__)
+
+_FRAME_HEADER = struct.Struct(">I")
+# Подписчик, который столько секунд не читает снимки, отключается, чтобы не задерживать остальных
+SUBSCRIBER_WRITE_TIMEOUT = 10.0
+RECONNECT_DELAY = 1.0
+RESTART_DELAY = 5.0
+# Сколько ждать сокет загрузчика перед запуском остальных процессов
+FETCHER_STARTUP_TIMEOUT = 30.0
+SHUTDOWN_TIMEOUT = 15.0
+
+
+def metrics_port(offset: int) -> int:
+    """Порт метрик процесса: у каждого процесса свой, 0 отключает метрики во всех."""
+    return config.metrics_port + offset if config.metrics_port else 0
+
+
+def _frame(message: tuple) -> bytes:
+    # marshal: быстрее pickle на списках кортежей и не выполняет код при разборе
+    payload = marshal.dumps(message)
+    return _FRAME_HEADER.pack(len(payload)) + payload
+
+
+def encode_snapshot(snapshot: QueueSnapshot) -> bytes:
+    rows = [(car.regnum, car.order_id, car.status, car.registered_at, car.changed_at) for car in snapshot.cars]
+    return _frame(("snapshot", snapshot.checkpoint.id, snapshot.fetched_ts, snapshot.age, rows))
+
+
+def encode_touch(snapshot: QueueSnapshot) -> bytes:
+    return _frame(("touch", snapshot.checkpoint.id, snapshot.fetched_ts, snapshot.age))
+
+
+async def read_message(reader: asyncio.StreamReader) -> tuple:
+    header = await reader.readexactly(_FRAME_HEADER.size)
+    (length,) = _FRAME_HEADER.unpack(header)
+    return marshal.loads(await reader.readexactly(length))
+
+
+async def wait_for_shutdown():
+    """Ждет SIGINT или SIGTERM (его присылает супервизор)."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+class SnapshotPublisher:
+    """
+    Сервер на Unix-сокете в процессе-загрузчике. Каждый новый снимок уходит всем
+    подписчикам целиком, неизменившийся - коротким сообщением "touch" (данные снова свежие).
+    Подключившийся подписчик сразу получает последние снимки всех пунктов пропуска.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self._published: Dict[str, QueueSnapshot] = {}
+        self._published_at: Dict[str, float] = {}
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._on_connect, self.path)
+        os.chmod(self.path, 0o600)
+        logger.info(f"Publishing queue snapshots on {self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._clients):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        for snapshot in self._published.values():
+            writer.write(encode_snapshot(snapshot))
+        self._clients.add(writer)
+        logger.info(f"Snapshot subscriber connected ({len(self._clients)} total)")
+        try:
+            # Подписчики ничего не присылают: чтение только замечает закрытие соединения
+            await reader.read()
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+            logger.info(f"Snapshot subscriber disconnected ({len(self._clients)} left)")
+
+    async def publish(self, snapshot: QueueSnapshot):
+        checkpoint_id = snapshot.checkpoint.id
+        if snapshot is not self._published.get(checkpoint_id):
+            frame = encode_snapshot(snapshot)
+        elif snapshot.loaded_at != self._published_at.get(checkpoint_id):
+            frame = encode_touch(snapshot)
+        else:
+            return
+        self._published[checkpoint_id] = snapshot
+        self._published_at[checkpoint_id] = snapshot.loaded_at
+        clients = list(self._clients)
+        for writer in clients:
+            writer.write(frame)
+        results = await asyncio.gather(
+            *(asyncio.wait_for(writer.drain(), SUBSCRIBER_WRITE_TIMEOUT) for writer in clients),
+            return_exceptions=True
+        )
+        for writer, result in zip(clients, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Dropping snapshot subscriber: {result!r}")
+                self._clients.discard(writer)
+                writer.close()
+
+
+class SnapshotSubscriber:
+    """
+    Клиент загрузчика в процессах dispatcher и notifier. Подменяет кэши снимков в services:
+    снимки приходят только от загрузчика, к API процесс не обращается.
+    При обрыве соединения переподключается; пока загрузчика нет, отдается последний полученный снимок.
+    track_throughput - самому считать темп вызовов (процессу, который не вызывает process_snapshot).
+    """
+    def __init__(
+        self,
+        path: str,
+        on_snapshot: Optional[Callable[[QueueSnapshot], None]] = None,
+        track_throughput: bool = False
+    ):
+        self.path = path
+        self.on_snapshot = on_snapshot
+        self.track_throughput = track_throughput
+        self._received: Dict[str, QueueSnapshot] = {}
+        self._task: Optional[asyncio.Task] = None
+        for checkpoint in config.checkpoints:
+            services.queue_caches[checkpoint.id] = SnapshotCache(
+                lambda checkpoint_id=checkpoint.id: self._latest(checkpoint_id),
+                ttl=config.snapshot_ttl,
+                stale_ttl=config.snapshot_stale_ttl,
+                refresh_timeout=config.snapshot_refresh_timeout
+            )
+
+    async def _latest(self, checkpoint_id: str) -> Optional[QueueSnapshot]:
+        return self._received.get(checkpoint_id)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="snapshot-subscriber")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        reported = False
+        while True:
+            writer = None
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                logger.info(f"Connected to snapshot publisher at {self.path}")
+                reported = False
+                while True:
+                    self._handle(await read_message(reader))
+            except (OSError, asyncio.IncompleteReadError, ValueError, EOFError) as e:
+                # Пока загрузчик недоступен, пишем в лог один раз, а не на каждую попытку
+                if not reported:
+                    logger.warning(f"Snapshot publisher unavailable: {e!r}")
+                    reported = True
+            finally:
+                if writer is not None:
+                    writer.close()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def _handle(self, message: tuple):
+        kind, checkpoint_id, *rest = message
+        checkpoint = config.get_checkpoint(checkpoint_id)
+        if checkpoint is None:
+            return
+        if kind == "snapshot":
+            fetched_ts, age, rows = rest
+            snapshot = QueueSnapshot(checkpoint, [QueueCar(*row) for row in rows])
+            snapshot.fetched_ts = fetched_ts
+            if self.track_throughput:
+                services.observe_calls(snapshot, self._received.get(checkpoint_id))
+        else:
+            snapshot = self._received.get(checkpoint_id)
+            if snapshot is None:
+                return
+            fetched_ts, age = rest
+            # Как и в загрузчике: пересчитываем время ожидания и сводку от нового времени данных
+            snapshot.touch()
+            snapshot.fetched_ts = fetched_ts
+        # Возраст данных считаем от загрузки в процессе-загрузчике, а не от получения здесь
+        snapshot.loaded_at = time.monotonic() - age
+        self._received[checkpoint_id] = snapshot
+        services.queue_caches[checkpoint_id].put(snapshot)
+        if kind == "snapshot" and self.on_snapshot is not None:
+            self.on_snapshot(snapshot)
+
+
+class ShardNotifier:
+    """
+    Проверяет машины своей доли пользователей по снимкам от загрузчика.
+    Пункты пропуска проверяются параллельно; если за время проверки пришло несколько
+    снимков одного пункта, обрабатывается только последний.
+    """
+    def __init__(self):
+        self._pending: Dict[str, QueueSnapshot] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, snapshot: QueueSnapshot):
+        self._pending[snapshot.checkpoint.id] = snapshot
+        self._wakeup.set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="shard-notifier")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            pending, self._pending = self._pending, {}
+            await asyncio.gather(*(self._check(snapshot) for snapshot in pending.values()))
+
+    async def _check(self, snapshot: QueueSnapshot):
+        timer = PhaseTimer(snapshot.checkpoint.name)
+        try:
+            await services.process_snapshot(snapshot.checkpoint, snapshot, timer)
+        except Exception as e:
+            logger.exception(f"Check for {snapshot.checkpoint.name} failed: {e!r}")
+        finally:
+            timer.finish(config.slow_tick_seconds)
+
+
+async def run_fetcher():
+    """Процесс-загрузчик: API, планировщик, история снимков; пользователей не проверяет."""
+    await db.initialize(config.checkpoints[0].id)
+    await services.api_client.start()
+    await services.history.start()
+    services.set_user_shard(None, notify_users=False)
+
+    publisher = SnapshotPublisher(config.cluster_socket)
+    await publisher.start()
+    if metrics_port(0):
+        await registry.start_server(config.metrics_host, metrics_port(0))
+
+    async def job() -> List[TickReport]:
+        reports = await services.scheduled_job()
+        for checkpoint in config.checkpoints:
+            snapshot = services.queue_caches[checkpoint.id].peek()
+            if snapshot is not None:
+                await publisher.publish(snapshot)
+        return reports
+
+    scheduler = AdaptiveScheduler(job, config.poll_min_interval, config.poll_max_interval)
+    scheduler.start()
+    try:
+        await wait_for_shutdown()
+    finally:
+        await scheduler.stop()
+        await publisher.stop()
+        await registry.stop_server()
+        await services.api_client.close()
+        await services.history.stop()
+        await db.close()
+        logger.info("Fetcher stopped")
+
+
+async def run_notifier(shard: int):
+    """Процесс-рассыльщик доли пользователей shard из config.notifier_shards."""
+    if not 0 <= shard < config.notifier_shards:
+        raise ValueError(f"Shard {shard} is out of range for NOTIFIER_SHARDS={config.notifier_shards}")
+    await db.initialize(config.checkpoints[0].id)
+    services.set_user_shard(UserShard(shard, config.notifier_shards))
+
+    bot = Bot(token=config.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
+    # Лимит Telegram общий на бота: делим его между рассыльщиками и обработчиком команд
+    services.outbox.set_global_rate(config.outbox_global_rate / (config.notifier_shards + 1))
+    services.outbox.start(bot)
+
+    notifier = ShardNotifier()
+    subscriber = SnapshotSubscriber(config.cluster_socket, notifier.submit)
+    notifier.start()
+    subscriber.start()
+    if metrics_port(2 + shard):
+        await registry.start_server(config.metrics_host, metrics_port(2 + shard))
+    try:
+        await wait_for_shutdown()
+    finally:
+        await subscriber.stop()
+        await notifier.stop()
+        await registry.stop_server()
+        await services.outbox.stop()
+        await bot.session.close()
+        await db.close()
+        logger.info(f"Notifier {shard} stopped")
+
+
+async def run_supervisor():
+    """
+    Запускает загрузчик, рассыльщиков и обработчик команд отдельными процессами bot.py
+    и перезапускает упавшие. Останавливается по SIGINT/SIGTERM вместе со всеми процессами.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+    processes: Dict[str, asyncio.subprocess.Process] = {}
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async def supervise(name: str, args: List[str]):
+        while not stop.is_set():
+            process = await asyncio.create_subprocess_exec(sys.executable, script, *args)
+            processes[name] = process
+            logger.info(f"Started {name} (pid {process.pid})")
+            await process.wait()
+            if stop.is_set():
+                return
+            logger.error(f"{name} exited with code {process.returncode}, restarting in {RESTART_DELAY:.0f}s")
+            try:
+                await asyncio.wait_for(stop.wait(), RESTART_DELAY)
+            except asyncio.TimeoutError:
+                pass
+
+    if os.path.exists(config.cluster_socket):
+        os.unlink(config.cluster_socket)
+    tasks = [asyncio.create_task(supervise("fetcher", ["--role", "fetcher"]))]
+    # Остальные процессы стартуют после загрузчика: он уже создал схему БД и слушает сокет
+    deadline = time.monotonic() + FETCHER_STARTUP_TIMEOUT
+    while not os.path.exists(config.cluster_socket) and time.monotonic() < deadline and not stop.is_set():
+        await asyncio.sleep(0.2)
+    for shard in range(config.notifier_shards):
+        tasks.append(asyncio.create_task(supervise(f"notifier {shard}", ["--role", "notifier", "--shard", str(shard)])))
+    tasks.append(asyncio.create_task(supervise("dispatcher", ["--role", "dispatcher"])))
+
+    await stop.wait()
+    logger.info("Stopping cluster...")
+    for process in processes.values():
+        if process.returncode is None:
+            process.terminate()
+    try:
+        await asyncio.wait_for(asyncio.gather(*(p.wait() for p in processes.values())), SHUTDOWN_TIMEOUT)
+    except asyncio.TimeoutError:
+        for process in processes.values():
+            if process.returncode is None:
+                process.kill()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    logger.info("Cluster stopped")
@@ -5,12 +5,75 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Переопределяется, например, для нагрузочных тестов с локальным API (benchmarks/)
+API_BASE_URL = os.getenv("BORDER_API_URL", "https://belarusborder.by/info/monitoring-new")
+DEFAULT_CHECKPOINTS = "a9173a85-3fc0-424c-84f0-defa632481e4:Основной пункт пропуска"
+
+@dataclass
+class Checkpoint:
+    id: str
+    name: str
+
+    @property
+    def api_url(self) -> str:
+        return f"{API_BASE_URL}?token=test&checkpointId={self.id}"
+
 @dataclass
 class Settings:
     bot_token: str
     valid_user_tokens: set[str]
-    api_url: str
+    checkpoints: list[Checkpoint]
+    max_parallel_polls: int
+    poll_min_interval: float
+    poll_max_interval: float
     timezone: str
+    snapshot_ttl: float
+    snapshot_stale_ttl: float
+    snapshot_refresh_timeout: float
+    http_connect_timeout: float
+    http_read_timeout: float
+    http_retries: int
+    circuit_failure_threshold: int
+    circuit_reset_timeout: float
+    outbox_workers: int
+    outbox_queue_size: int
+    outbox_global_rate: float
+    outbox_chat_rate: float
+    outbox_chat_burst: int
+    history_db_name: str
+    history_retention_days: float
+    auth_negative_cache_size: int
+    live_cards: bool
+    metrics_host: str
+    metrics_port: int
+    slow_tick_seconds: float
+    notifier_shards: int
+    cluster_socket: str
+    webhook_enabled: bool
+    webhook_url: str
+    webhook_path: str
+    webhook_secret: str
+    webhook_host: str
+    webhook_port: int
+    webhook_workers: int
+    webhook_queue_size: int
+
+    def get_checkpoint(self, checkpoint_id: str) -> Checkpoint | None:
+        return next((cp for cp in self.checkpoints if cp.id == checkpoint_id), None)
+
+def parse_checkpoints(value: str) -> list[Checkpoint]:
+    """
+    Разбирает строку вида "id1:Название 1,id2:Название 2".
+    Если название не указано, вместо него используется id.
+    """
+    checkpoints = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        checkpoint_id, _, name = item.partition(':')
+        checkpoints.append(Checkpoint(id=checkpoint_id.strip(), name=name.strip() or checkpoint_id.strip()))
+    return checkpoints
 
 def load_config() -> Settings:
     bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -20,11 +83,77 @@ def load_config() -> Settings:
     tokens_str = os.getenv("VALID_USER_TOKENS", "")
     valid_tokens = set(token.strip() for token in tokens_str.split(','))
 
+    checkpoints = parse_checkpoints(os.getenv("CHECKPOINTS", DEFAULT_CHECKPOINTS))
+    if not checkpoints:
+        raise ValueError("CHECKPOINTS не содержит ни одного пункта пропуска")
+
+    webhook_enabled = os.getenv("WEBHOOK", "0").lower() in ("1", "true", "yes")
+    webhook_secret = os.getenv("WEBHOOK_SECRET", "")
+    if webhook_enabled and not webhook_secret:
+        # Без секрета любой, кто знает адрес, может прислать обновление от имени авторизованного пользователя
+        raise ValueError("WEBHOOK_SECRET обязателен в режиме WEBHOOK=1")
+
     return Settings(
         bot_token=bot_token,
         valid_user_tokens=valid_tokens,
-        api_url="https://belarusborder.by/info/monitoring-new?token=test&checkpointId=a9173a85-3fc0-424c-84f0-defa632481e4",
-        timezone="Europe/Minsk"
+        checkpoints=checkpoints,
+        # Сколько пунктов пропуска опрашивать одновременно
+        max_parallel_polls=int(os.getenv("MAX_PARALLEL_POLLS", "4")),
+        # Границы адаптивного интервала опроса API
+        poll_min_interval=float(os.getenv("POLL_MIN_INTERVAL_SECONDS", "15")),
+        poll_max_interval=float(os.getenv("POLL_MAX_INTERVAL_SECONDS", "300")),
+        timezone="Europe/Minsk",
+        # Сколько секунд снимок очереди считается свежим и не запрашивается повторно
+        snapshot_ttl=float(os.getenv("SNAPSHOT_TTL_SECONDS", "30")),
+        # Сколько секунд можно отдавать последний удачный снимок, если API недоступен
+        snapshot_stale_ttl=float(os.getenv("SNAPSHOT_STALE_TTL_SECONDS", "600")),
+        snapshot_refresh_timeout=float(os.getenv("SNAPSHOT_REFRESH_TIMEOUT_SECONDS", "5")),
+        http_connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5")),
+        http_read_timeout=float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "15")),
+        http_retries=int(os.getenv("HTTP_RETRIES", "2")),
+        # После скольких неудачных запросов подряд перестаем обращаться к API и на сколько секунд
+        circuit_failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+        circuit_reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT_SECONDS", "60")),
+        # Лимиты Telegram: около 30 сообщений в секунду всего и около 1 в секунду на чат
+        outbox_workers=int(os.getenv("OUTBOX_WORKERS", "4")),
+        outbox_queue_size=int(os.getenv("OUTBOX_QUEUE_SIZE", "10000")),
+        outbox_global_rate=float(os.getenv("OUTBOX_GLOBAL_RATE", "25")),
+        outbox_chat_rate=float(os.getenv("OUTBOX_CHAT_RATE", "1")),
+        outbox_chat_burst=int(os.getenv("OUTBOX_CHAT_BURST", "3")),
+        # История снимков очереди хранится в отдельной базе, чтобы не мешать основной
+        history_db_name=os.getenv("HISTORY_DB_NAME", "history.db"),
+        history_retention_days=float(os.getenv("HISTORY_RETENTION_DAYS", "14")),
+        # Сколько неавторизованных пользователей помнить, чтобы не спрашивать БД на каждое их сообщение
+        auth_negative_cache_size=int(os.getenv("AUTH_NEGATIVE_CACHE_SIZE", "10000")),
+        # Одна обновляемая карточка на машину вместо нового сообщения на каждое изменение.
+        # По умолчанию выключено: уведомления остаются полными, как раньше
+        live_cards=os.getenv("LIVE_CARDS", "0").lower() in ("1", "true", "yes"),
+        # Метрики в формате Prometheus на http://host:port/metrics; порт 0 отключает эндпоинт
+        metrics_host=os.getenv("METRICS_HOST", "127.0.0.1"),
+        metrics_port=int(os.getenv("METRICS_PORT", "9108")),
+        # Проверка пункта пропуска дольше этого порога пишется в лог с разбивкой по фазам (0 - не писать)
+        slow_tick_seconds=float(os.getenv("SLOW_TICK_SECONDS", "10")),
+        # Многопроцессный режим (cluster.py): один загрузчик очереди и столько процессов-рассыльщиков,
+        # пользователи делятся между ними по user_id; 0 - все в одном процессе.
+        # Метрики: загрузчик на METRICS_PORT, обработчик команд на +1, рассыльщики на +2, +3, ...
+        notifier_shards=int(os.getenv("NOTIFIER_SHARDS", "0")),
+        # Unix-сокет, через который загрузчик раздает снимки очереди остальным процессам
+        cluster_socket=os.getenv("CLUSTER_SOCKET", "border-cluster.sock"),
+        # Прием обновлений через webhook вместо long polling (webhook.py). Только одна реплика:
+        # планировщик, состояния FSM и кэш авторизации живут в памяти процесса
+        webhook_enabled=webhook_enabled,
+        # Публичный https-адрес, который регистрируется в Telegram при старте;
+        # пустой - не регистрировать (адрес задан снаружи или локальная проверка через benchmarks/replay_updates.py)
+        webhook_url=os.getenv("WEBHOOK_URL", ""),
+        webhook_path=os.getenv("WEBHOOK_PATH", "/telegram/webhook"),
+        # Telegram присылает его в X-Telegram-Bot-Api-Secret-Token; запросы без него отклоняются.
+        # В режиме webhook обязателен
+        webhook_secret=webhook_secret,
+        webhook_host=os.getenv("WEBHOOK_HOST", "127.0.0.1"),
+        webhook_port=int(os.getenv("WEBHOOK_PORT", "8080")),
+        # Сколько обновлений обрабатывается одновременно и сколько может ждать в очереди
+        webhook_workers=int(os.getenv("WEBHOOK_WORKERS", "16")),
+        webhook_queue_size=int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
     )
 
 config = load_config()
\ No newline at end of file
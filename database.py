@@ -1,85 +1,277 @@
-# database.py
+import asyncio
 import aiosqlite
-from typing import List, Tuple, Optional, Dict
+from typing import Iterable, List, Tuple, Optional, Dict
+
+from metrics import DB_LATENCY, DB_QUERIES, instrument_methods
 
 DB_NAME = "bot_data.db"
+# Сколько номеров подставлять в один запрос WHERE ... IN (...)
+SQL_BATCH_SIZE = 500
+
+# Состояние отслеживаемой машины для планировщика:
+# (user_id, regnum, notified_pos, last_status, card_message_id, card_hash)
+TrackedCarState = Tuple[int, str, Optional[int], Optional[int], Optional[int], Optional[str]]
+TRACKED_STATE_COLUMNS = "user_id, regnum, notified_pos, last_status, card_message_id, card_hash"
+
+# Настройки SQLite для одного долгоживущего соединения
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA busy_timeout=5000",
+)
 
+CARS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        checkpoint_id TEXT NOT NULL,
+        regnum TEXT NOT NULL,
+        notified_pos INTEGER,
+        last_status INTEGER,
+        card_message_id INTEGER,
+        card_hash TEXT,
+        UNIQUE (checkpoint_id, regnum),
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    );
+"""
+
+# Каждый публичный метод считается и замеряется в метриках db_queries_total / db_query_seconds
+@instrument_methods(DB_LATENCY, DB_QUERIES)
 class Database:
     def __init__(self, db_name: str):
         self.db_name = db_name
+        self._conn: Optional[aiosqlite.Connection] = None
+        # Одно соединение на всех: транзакции записи не должны перемежаться
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def conn(self) -> aiosqlite.Connection:
+        if self._conn is None:
+            raise RuntimeError("Database is not initialized, call initialize() first")
+        return self._conn
+
+    async def initialize(self, default_checkpoint_id: str):
+        """
+        Открывает соединение и создает схему.
+        default_checkpoint_id присваивается машинам из старой схемы без пунктов пропуска.
+        """
+        if self._conn is None:
+            self._conn = await aiosqlite.connect(self.db_name)
+            for pragma in PRAGMAS:
+                await self._conn.execute(pragma)
 
-    async def initialize(self):
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    is_authorized INTEGER NOT NULL DEFAULT 0
-                );
-            """)
-            # Поле last_pos переименовано в notified_pos для ясности
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS cars (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    regnum TEXT NOT NULL UNIQUE,
-                    notified_pos INTEGER,
-                    last_status INTEGER,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                );
-            """)
-            await db.commit()
+        db = self._conn
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                is_authorized INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        await self._migrate_cars_to_checkpoints(default_checkpoint_id)
+        # Поле last_pos переименовано в notified_pos для ясности.
+        # Номер уникален в пределах пункта пропуска, а не глобально.
+        await db.execute(CARS_TABLE_SQL.format(table="cars"))
+        await self._add_card_columns()
+        # (checkpoint_id, regnum) уже проиндексирован через UNIQUE, для выборок по пользователю нужен свой индекс
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_cars_user_id ON cars (user_id);")
+        # Для планировщика: ближайшая к вызову отслеживаемая машина без полного просмотра таблицы
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_cars_checkpoint_pos ON cars (checkpoint_id, notified_pos);")
+        # Машины, которые еще ни разу не сверялись с очередью (добавлены, когда снимка не было)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_cars_unchecked ON cars (checkpoint_id) WHERE last_status IS NULL;")
+        await db.commit()
+
+    async def _migrate_cars_to_checkpoints(self, default_checkpoint_id: str):
+        cursor = await self.conn.execute("PRAGMA table_info(cars)")
+        columns = {row[1] for row in await cursor.fetchall()}
+        if not columns or "checkpoint_id" in columns:
+            return
+        # UNIQUE(regnum) нельзя изменить через ALTER TABLE, поэтому пересоздаем таблицу
+        await self.conn.execute(CARS_TABLE_SQL.format(table="cars_new"))
+        await self.conn.execute(
+            "INSERT INTO cars_new (id, user_id, checkpoint_id, regnum, notified_pos, last_status) "
+            "SELECT id, user_id, ?, regnum, notified_pos, last_status FROM cars",
+            (default_checkpoint_id,)
+        )
+        await self.conn.execute("DROP TABLE cars")
+        await self.conn.execute("ALTER TABLE cars_new RENAME TO cars")
+        await self.conn.commit()
+
+    async def _add_card_columns(self):
+        """Живые карточки: id сообщения с карточкой машины и хеш ее последнего текста."""
+        cursor = await self.conn.execute("PRAGMA table_info(cars)")
+        columns = {row[1] for row in await cursor.fetchall()}
+        if "card_message_id" not in columns:
+            await self.conn.execute("ALTER TABLE cars ADD COLUMN card_message_id INTEGER")
+        if "card_hash" not in columns:
+            await self.conn.execute("ALTER TABLE cars ADD COLUMN card_hash TEXT")
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def _write(self, sql: str, params: Tuple = ()):
+        async with self._write_lock:
+            await self.conn.execute(sql, params)
+            await self.conn.commit()
+
+    async def _write_many(self, statements: List[Tuple[str, List[Tuple]]]):
+        """
+        Несколько executemany одной транзакцией; пустые пачки пропускаются.
+        Не попадает в метрики сам по себе, поэтому публичные методы на нем не считаются дважды.
+        """
+        statements = [(sql, rows) for sql, rows in statements if rows]
+        if not statements:
+            return
+        async with self._write_lock:
+            try:
+                for sql, rows in statements:
+                    await self.conn.executemany(sql, rows)
+                await self.conn.commit()
+            except Exception:
+                await self.conn.rollback()
+                raise
 
     async def is_user_authorized(self, user_id: int) -> bool:
-        async with aiosqlite.connect(self.db_name) as db:
-            cursor = await db.execute("SELECT is_authorized FROM users WHERE user_id = ?", (user_id,))
-            result = await cursor.fetchone()
-            return result[0] == 1 if result else False
+        cursor = await self.conn.execute("SELECT is_authorized FROM users WHERE user_id = ?", (user_id,))
+        result = await cursor.fetchone()
+        return result[0] == 1 if result else False
+
+    async def get_authorized_user_ids(self) -> List[int]:
+        cursor = await self.conn.execute("SELECT user_id FROM users WHERE is_authorized = 1")
+        return [row[0] for row in await cursor.fetchall()]
 
     async def authorize_user(self, user_id: int):
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
-            await db.execute("UPDATE users SET is_authorized = 1 WHERE user_id = ?", (user_id,))
-            await db.commit()
+        async with self._write_lock:
+            await self.conn.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+            await self.conn.execute("UPDATE users SET is_authorized = 1 WHERE user_id = ?", (user_id,))
+            await self.conn.commit()
 
-    async def add_car(self, user_id: int, car_number: str):
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute("INSERT OR IGNORE INTO cars (user_id, regnum) VALUES (?, ?)", (user_id, car_number))
-            await db.commit()
+    async def add_cars(self, user_id: int, checkpoint_id: str, car_numbers: List[str]) -> List[str]:
+        """
+        Добавляет несколько машин одной транзакцией.
+        Возвращает номера, которые действительно добавлены (без уже отслеживаемых).
+        """
+        added = []
+        async with self._write_lock:
+            try:
+                for car_number in car_numbers:
+                    cursor = await self.conn.execute(
+                        "INSERT OR IGNORE INTO cars (user_id, checkpoint_id, regnum) VALUES (?, ?, ?)",
+                        (user_id, checkpoint_id, car_number)
+                    )
+                    if cursor.rowcount:
+                        added.append(car_number)
+                await self.conn.commit()
+            except Exception:
+                await self.conn.rollback()
+                raise
+        return added
 
-    async def get_user_cars(self, user_id: int) -> List[str]:
-        async with aiosqlite.connect(self.db_name) as db:
-            cursor = await db.execute("SELECT regnum FROM cars WHERE user_id = ?", (user_id,))
-            return [row[0] for row in await cursor.fetchall()]
+    async def get_user_cars(self, user_id: int) -> List[Tuple[str, str]]:
+        """Машины пользователя: (checkpoint_id, regnum)."""
+        cursor = await self.conn.execute("SELECT checkpoint_id, regnum FROM cars WHERE user_id = ?", (user_id,))
+        return await cursor.fetchall()
 
     async def delete_all_cars(self, user_id: int):
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute("DELETE FROM cars WHERE user_id = ?", (user_id,))
-            await db.commit()
-            
-    async def get_car_state(self, car_number: str) -> Optional[Dict]:
-        async with aiosqlite.connect(self.db_name) as db:
-            cursor = await db.execute("SELECT notified_pos, last_status FROM cars WHERE regnum = ?", (car_number,))
-            row = await cursor.fetchone()
-            return {"notified_pos": row[0], "last_status": row[1]} if row else None
-
-    async def update_car_state(self, car_number: str, pos: Optional[int], status: int):
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute("UPDATE cars SET notified_pos = ?, last_status = ? WHERE regnum = ?", (pos, status, car_number))
-            await db.commit()
-            
-    async def update_car_status_only(self, car_number: str, status: int):
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute("UPDATE cars SET last_status = ? WHERE regnum = ?", (status, car_number))
-            await db.commit()
-
-    async def remove_car(self, car_number: str):
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute("DELETE FROM cars WHERE regnum = ?", (car_number,))
-            await db.commit()
-
-    async def get_all_tracked_cars(self) -> List[Tuple[int, str]]:
-        async with aiosqlite.connect(self.db_name) as db:
-            cursor = await db.execute("SELECT user_id, regnum FROM cars")
-            return await cursor.fetchall()
-
-db = Database(DB_NAME)
\ No newline at end of file
+        await self._write("DELETE FROM cars WHERE user_id = ?", (user_id,))
+
+    async def get_car_state(self, checkpoint_id: str, car_number: str) -> Optional[Dict]:
+        cursor = await self.conn.execute(
+            "SELECT notified_pos, last_status, card_message_id, card_hash FROM cars WHERE checkpoint_id = ? AND regnum = ?",
+            (checkpoint_id, car_number)
+        )
+        row = await cursor.fetchone()
+        if not row:
+            return None
+        return {"notified_pos": row[0], "last_status": row[1], "card_message_id": row[2], "card_hash": row[3]}
+
+    async def set_car_card(self, checkpoint_id: str, car_number: str, message_id: Optional[int], card_hash: Optional[str]):
+        await self._write(
+            "UPDATE cars SET card_message_id = ?, card_hash = ? WHERE checkpoint_id = ? AND regnum = ?",
+            (message_id, card_hash, checkpoint_id, car_number)
+        )
+
+    async def remove_car(self, checkpoint_id: str, car_number: str):
+        await self._write("DELETE FROM cars WHERE checkpoint_id = ? AND regnum = ?", (checkpoint_id, car_number))
+
+    async def remove_cars(self, cars: List[Tuple[str, str]]):
+        """Удаляет несколько машин (checkpoint_id, regnum) одной транзакцией."""
+        await self._write_many([("DELETE FROM cars WHERE checkpoint_id = ? AND regnum = ?", cars)])
+
+    async def get_all_tracked_cars_state(self, checkpoint_id: str) -> List[TrackedCarState]:
+        """
+        Состояние всех отслеживаемых машин пункта пропуска одним запросом:
+        (user_id, regnum, notified_pos, last_status, card_message_id, card_hash).
+        """
+        cursor = await self.conn.execute(
+            f"SELECT {TRACKED_STATE_COLUMNS} FROM cars WHERE checkpoint_id = ?", (checkpoint_id,)
+        )
+        return await cursor.fetchall()
+
+    async def get_tracked_cars_state(
+        self,
+        checkpoint_id: str,
+        car_numbers: Iterable[str]
+    ) -> List[TrackedCarState]:
+        """
+        То же, что get_all_tracked_cars_state, но только для переданных номеров.
+        Номера запрашиваются пачками, чтобы не упереться в лимит параметров SQLite.
+        """
+        car_numbers = list(car_numbers)
+        rows = []
+        for i in range(0, len(car_numbers), SQL_BATCH_SIZE):
+            chunk = car_numbers[i:i + SQL_BATCH_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            cursor = await self.conn.execute(
+                f"SELECT {TRACKED_STATE_COLUMNS} FROM cars "
+                f"WHERE checkpoint_id = ? AND regnum IN ({placeholders})",
+                (checkpoint_id, *chunk)
+            )
+            rows.extend(await cursor.fetchall())
+        return rows
+
+    async def get_unchecked_cars_state(self, checkpoint_id: str) -> List[TrackedCarState]:
+        """Машины, которые еще ни разу не сверялись с очередью (last_status не задан)."""
+        cursor = await self.conn.execute(
+            f"SELECT {TRACKED_STATE_COLUMNS} FROM cars WHERE checkpoint_id = ? AND last_status IS NULL", (checkpoint_id,)
+        )
+        return await cursor.fetchall()
+
+    async def count_tracked_cars(self, checkpoint_id: str) -> int:
+        cursor = await self.conn.execute("SELECT COUNT(*) FROM cars WHERE checkpoint_id = ?", (checkpoint_id,))
+        row = await cursor.fetchone()
+        return row[0] if row else 0
+
+    async def get_closest_tracked_position(self, checkpoint_id: str) -> Optional[int]:
+        """
+        Минимальная сохраненная позиция среди отслеживаемых машин пункта пропуска.
+        notified_pos обновляется при каждом пороговом уведомлении, поэтому близко к вызову
+        он отличается от текущей позиции всего на несколько мест.
+        """
+        cursor = await self.conn.execute(
+            "SELECT MIN(notified_pos) FROM cars WHERE checkpoint_id = ? AND notified_pos IS NOT NULL", (checkpoint_id,)
+        )
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def apply_car_updates(
+        self,
+        state_updates: List[Tuple[Optional[int], int, str, str]],
+        status_updates: List[Tuple[int, str, str]],
+        removals: List[Tuple[str, str]]
+    ):
+        """
+        Применяет все изменения за тик одной транзакцией.
+        state_updates: (notified_pos, last_status, checkpoint_id, regnum),
+        status_updates: (last_status, checkpoint_id, regnum), removals: (checkpoint_id, regnum).
+        """
+        await self._write_many([
+            ("UPDATE cars SET notified_pos = ?, last_status = ? WHERE checkpoint_id = ? AND regnum = ?", state_updates),
+            ("UPDATE cars SET last_status = ? WHERE checkpoint_id = ? AND regnum = ?", status_updates),
+            ("DELETE FROM cars WHERE checkpoint_id = ? AND regnum = ?", removals),
+        ])
+
+db = Database(DB_NAME)
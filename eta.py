@@ -0,0 +1,106 @@
+# eta.py
+import bisect
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Скользящие окна для оценки пропускной способности, от коротких к длинным (секунды)
+THROUGHPUT_WINDOWS = (15 * 60, 60 * 60, 3 * 60 * 60)
+# Сколько вызовов должно попасть в окно, чтобы ему можно было доверять
+MIN_EVENTS_PER_WINDOW = 5
+
+
+class EtaTable:
+    """
+    Оценка времени до вызова для одного снимка очереди.
+    Темп считается один раз на снимок, результаты по позициям кэшируются,
+    так что рендер тысячи сообщений не повторяет вычисления.
+    """
+    def __init__(self, cars_per_hour: Optional[float], called_ahead: int = 0):
+        self.cars_per_hour = cars_per_hour
+        # Машины со статусом "Вызван в ПП" занимают первые позиции, но ждать их не нужно
+        self.called_ahead = called_ahead
+        self._cache: Dict[int, float] = {}
+
+    def eta_seconds(self, position: Optional[int]) -> Optional[float]:
+        if position is None or not self.cars_per_hour:
+            return None
+        eta = self._cache.get(position)
+        if eta is None:
+            cars_ahead = max(position - self.called_ahead, 1)
+            eta = self._cache[position] = cars_ahead / self.cars_per_hour * 3600
+        return eta
+
+    def eta_many(self, positions: Sequence[Optional[int]]) -> List[Optional[float]]:
+        """ETA для всех позиций за один проход: темп общий, считается один раз."""
+        if not self.cars_per_hour:
+            return [None] * len(positions)
+        seconds_per_car = 3600 / self.cars_per_hour
+        called_ahead = self.called_ahead
+        etas = [
+            None if position is None else max(position - called_ahead, 1) * seconds_per_car
+            for position in positions
+        ]
+        self._cache.update((position, eta) for position, eta in zip(positions, etas) if position is not None)
+        return etas
+
+
+class ThroughputEstimator:
+    """
+    Пропускная способность пунктов пропуска: сколько машин в час переходит в статус
+    "Вызван в ПП". Вызовы берутся из разницы между снимками (время вызова - changed_date).
+    """
+    def __init__(self, windows: Sequence[int] = THROUGHPUT_WINDOWS, min_events: int = MIN_EVENTS_PER_WINDOW):
+        self.windows = tuple(sorted(windows))
+        self.min_events = min_events
+        self._calls: Dict[str, List[int]] = {}
+        self._observed_since: Dict[str, int] = {}
+
+    def observe(self, checkpoint_id: str, now: int, called_at: Iterable[Optional[int]]):
+        """
+        Добавляет времена вызовов, замеченных в очередном снимке.
+        Для первого снимка сюда передаются все машины, уже вызванные в ПП.
+        """
+        calls = self._calls.setdefault(checkpoint_id, [])
+        since = self._observed_since.get(checkpoint_id, now)
+        for ts in called_at:
+            if ts is None or ts > now:
+                continue
+            bisect.insort(calls, ts)
+            since = min(since, ts)
+        self._observed_since[checkpoint_id] = since
+        # Вызовы старше самого длинного окна больше не нужны
+        del calls[:bisect.bisect_left(calls, now - self.windows[-1])]
+
+    def cars_per_hour(self, checkpoint_id: str, now: int) -> Optional[float]:
+        """
+        Темп по самому короткому окну, в котором достаточно вызовов;
+        если такого нет - по самому длинному. None, если данных еще нет.
+        """
+        calls = self._calls.get(checkpoint_id)
+        since = self._observed_since.get(checkpoint_id)
+        if not calls or since is None:
+            return None
+        for window in self.windows:
+            start = now - window
+            count = len(calls) - bisect.bisect_left(calls, start)
+            if count >= self.min_events or window == self.windows[-1]:
+                # Если наблюдаем меньше окна, делим на реально наблюдаемый интервал
+                span = now - max(start, since)
+                if count == 0 or span <= 0:
+                    return None
+                return count / span * 3600
+        return None
+
+    def recent_calls(self, checkpoint_id: str, now: int, window: int) -> Tuple[int, int]:
+        """
+        Сколько вызовов было за последние window секунд и за сколько секунд из них
+        есть наблюдения (меньше window, если бот запущен недавно). (0, 0) - данных нет.
+        """
+        calls = self._calls.get(checkpoint_id)
+        since = self._observed_since.get(checkpoint_id)
+        if calls is None or since is None:
+            return 0, 0
+        start = now - window
+        return len(calls) - bisect.bisect_left(calls, start), max(0, now - max(start, since))
+
+    def table(self, checkpoint_id: str, now: int, called_ahead: int = 0) -> EtaTable:
+        return EtaTable(self.cars_per_hour(checkpoint_id, now), called_ahead)
@@ -1,30 +1,52 @@
 # handlers.py
-import asyncio
-from aiogram import Router, F, Bot
-from aiogram.filters import CommandStart, Command
+import re
+from typing import List, Optional
+
+from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import CommandObject, CommandStart, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, Message
 
+from auth import AuthMiddleware, auth_cache
 from database import db
-from keyboards import get_main_menu_keyboard
-from services import check_and_notify_user, fetch_queue_data, format_car_info
+from keyboards import (
+    CarDetailCallback, CheckpointCallback, FleetPageCallback,
+    get_checkpoints_keyboard, get_fleet_keyboard, get_main_menu_keyboard
+)
+from services import (
+    FleetStatus, check_and_notify_user, format_fleet_page, format_queue_overview, get_queue_snapshot, outbox,
+    resolve_user_cars, start_tracking
+)
 from config import config
 
 router = Router()
 
+# Сколько номеров можно добавить одним сообщением
+MAX_CARS_PER_MESSAGE = 50
+ENTER_CAR_NUMBER_TEXT = (
+    "Пожалуйста, введите гос. номер автомобиля (например, `1234AB7`).\n"
+    "Можно отправить сразу несколько номеров - через запятую или каждый с новой строки."
+)
+
+# Проверка доступа по кэшу в памяти; обработчики с флагом authorized закрыты для неавторизованных
+router.message.middleware(AuthMiddleware(auth_cache))
+router.callback_query.middleware(AuthMiddleware(auth_cache))
+
 class UserForm(StatesGroup):
     waiting_for_token = State()
+    waiting_for_checkpoint = State()
     waiting_for_car_number = State()
 
 # --- Обработчики команд и кнопок ---
 
 @router.message(CommandStart())
-async def handle_start(message: Message, state: FSMContext):
+async def handle_start(message: Message, state: FSMContext, is_authorized: bool):
     """
     Обработчик команды /start. Проверяет авторизацию и приветствует пользователя.
     """
-    if await db.is_user_authorized(message.from_user.id):
+    if is_authorized:
         await message.answer(
             "С возвращением! 👋\n\n"
             "Используйте кнопки внизу или команды для управления.",
@@ -36,84 +58,145 @@ async def handle_start(message: Message, state: FSMContext):
 
 
 # 👇 ИСПРАВЛЕННЫЙ ДЕКОРАТОР: теперь их два для одной функции
-@router.message(F.text == "🚗 Мои авто")
-@router.message(Command("mycars"))
-async def handle_my_cars(message: Message, bot: Bot):
+@router.message(F.text == "🚗 Мои авто", flags={"authorized": True})
+@router.message(Command("mycars"), flags={"authorized": True})
+async def handle_my_cars(message: Message):
     """
-    Выводит детальную информацию по каждому отслеживаемому автомобилю.
+    Выводит информацию по отслеживаемым автомобилям: по одному - подробную карточку,
+    по нескольким - одну сводку с постраничной таблицей и кнопками подробностей.
     """
     user_id = message.from_user.id
-    if not await db.is_user_authorized(user_id):
-        await message.answer("Пожалуйста, сначала пройдите авторизацию. Отправьте команду /start.")
-        return
-
     cars = await db.get_user_cars(user_id)
     if not cars:
-        await message.answer("У вас нет отслеживаемых автомобилей. Добавьте первый с помощью команды `/add` или кнопки.")
-        return
-
-    await message.answer("🔍 Запрашиваю актуальную информацию о ваших авто...")
-    api_data = await fetch_queue_data()
-    if not api_data or "carLiveQueue" not in api_data:
-        await message.answer("Не удалось получить данные об очереди. Пожалуйста, попробуйте позже.")
-        return
-
-    queue = api_data["carLiveQueue"]
-    total_cars_in_queue = len(queue)
-    found_any = False
-
-    for car_number in cars:
-        user_car_data = next((c for c in queue if c["regnum"] == car_number), None)
-        
-        if user_car_data:
-            found_any = True
-            first_car_overall = queue[0] if queue else None
-            first_waiting_car = None
-            if first_car_overall and first_car_overall.get('status') == 3:
-                first_waiting_car = next((c for c in queue if c.get("status") != 3), None)
-            
-            info_text = format_car_info(user_car_data, total_cars_in_queue, first_car_overall, first_waiting_car)
-            await message.answer(info_text)
+        await outbox.send(message.chat.id, "У вас нет отслеживаемых автомобилей. Добавьте первый с помощью команды `/add` или кнопки.")
+        return
+
+    # Все машины сопоставляются со снимками за один проход
+    fleet = await resolve_user_cars(cars)
+    if not fleet.found and not fleet.missing:
+        await outbox.send(message.chat.id, "Не удалось получить данные об очереди. Пожалуйста, попробуйте позже.")
+        return
+
+    # Пропавшие из очереди машины удаляем одной транзакцией
+    await db.remove_cars(fleet.missing)
+
+    if len(cars) == 1:
+        if fleet.found:
+            snapshot, user_car_data = fleet.found[0]
+            await outbox.send(message.chat.id, snapshot.format_car_info(user_car_data, snapshot.eta.eta_seconds(user_car_data.order_id)))
         else:
-            await message.answer(f"ℹ️ Автомобиль `{car_number}` не найден в текущей очереди. Возможно, он уже проехал границу. Удаляю его из вашего списка.")
-            await db.remove_car(car_number)
-        
-        await asyncio.sleep(0.5)
+            await outbox.send(message.chat.id, f"ℹ️ Автомобиль `{cars[0][1]}` не найден в текущей очереди. Возможно, он уже проехал границу. Удаляю его из вашего списка.")
+        return
+
+    if not fleet.found and not fleet.unavailable:
+        await outbox.send(message.chat.id, "Ни один из ваших автомобилей не найден в текущей очереди. Возможно, они все уже проехали. Список очищен.")
+        return
+
+    await outbox.send(message.chat.id, format_fleet_page(fleet, 0, removed=fleet.missing), reply_markup=_fleet_keyboard(fleet, 0))
 
-    if not found_any and cars:
-        await message.answer("Ни один из ваших автомобилей не найден в текущей очереди. Возможно, они все уже проехали.")
+
+def _fleet_keyboard(fleet: FleetStatus, page: int) -> InlineKeyboardMarkup:
+    cars = [(snapshot.checkpoint.id, car.regnum) for snapshot, car in fleet.page_entries(page)]
+    return get_fleet_keyboard(cars, page, fleet.pages)
+
+
+@router.callback_query(FleetPageCallback.filter(), flags={"authorized": True})
+async def process_fleet_page(callback: CallbackQuery, callback_data: FleetPageCallback):
+    """
+    Переключает страницу сводки по автопарку.
+    """
+    cars = await db.get_user_cars(callback.from_user.id)
+    fleet = await resolve_user_cars(cars)
+    await db.remove_cars(fleet.missing)
+    page = min(max(callback_data.page, 0), fleet.pages - 1)
+
+    await callback.answer()
+    try:
+        await callback.message.edit_text(
+            format_fleet_page(fleet, page, removed=fleet.missing), reply_markup=_fleet_keyboard(fleet, page)
+        )
+    except TelegramBadRequest:
+        # Содержимое не изменилось (например, нажата кнопка с номером текущей страницы)
+        pass
+
+
+@router.callback_query(CarDetailCallback.filter(), flags={"authorized": True})
+async def process_car_detail(callback: CallbackQuery, callback_data: CarDetailCallback):
+    """
+    Подробная карточка одной машины из сводки.
+    """
+    cars = await db.get_user_cars(callback.from_user.id)
+    if (callback_data.checkpoint_id, callback_data.regnum) not in cars:
+        await callback.answer("Этот автомобиль больше не отслеживается.", show_alert=True)
+        return
+
+    snapshot = await get_queue_snapshot(callback_data.checkpoint_id)
+    if snapshot is None:
+        await callback.answer("Не удалось получить данные об очереди. Попробуйте позже.", show_alert=True)
+        return
+
+    user_car_data = snapshot.find(callback_data.regnum)
+    await callback.answer()
+    if user_car_data is None:
+        await db.remove_car(callback_data.checkpoint_id, callback_data.regnum)
+        await outbox.send(callback.message.chat.id, f"ℹ️ Автомобиль `{callback_data.regnum}` не найден в текущей очереди. Удаляю его из вашего списка.")
+        return
+    await outbox.send(
+        callback.message.chat.id,
+        snapshot.format_car_info(user_car_data, snapshot.eta.eta_seconds(user_car_data.order_id))
+    )
 
 
 # 👇 ИСПРАВЛЕННЫЙ ДЕКОРАТОР
-@router.message(F.text == "✅ Добавить авто")
-@router.message(Command("add"))
-async def handle_add_command(message: Message, state: FSMContext):
+@router.message(F.text == "✅ Добавить авто", flags={"authorized": True})
+@router.message(Command("add"), flags={"authorized": True})
+async def handle_add_command(message: Message, state: FSMContext, command: Optional[CommandObject] = None):
     """
     Начинает процесс добавления нового автомобиля.
+    Номера можно передать сразу: `/add 1234AB7, 5678CD7`.
     """
-    if not await db.is_user_authorized(message.from_user.id):
-        await message.answer("Пожалуйста, сначала пройдите авторизацию. Отправьте команду /start.")
+    car_numbers = parse_car_numbers(command.args) if command and command.args else []
+    if len(car_numbers) > MAX_CARS_PER_MESSAGE:
+        await message.answer(f"❌ За один раз можно добавить не больше {MAX_CARS_PER_MESSAGE} номеров.")
+        return
+
+    if len(config.checkpoints) > 1:
+        # Номера из команды ждут выбора пункта пропуска
+        await state.update_data(pending_car_numbers=car_numbers)
+        await state.set_state(UserForm.waiting_for_checkpoint)
+        await message.answer("Выберите пункт пропуска:", reply_markup=get_checkpoints_keyboard(config.checkpoints))
+        return
+
+    if car_numbers:
+        await _add_cars(message, state, message.from_user.id, config.checkpoints[0].id, car_numbers)
         return
-        
+
+    await state.update_data(checkpoint_id=config.checkpoints[0].id)
     await state.set_state(UserForm.waiting_for_car_number)
-    await message.answer("Пожалуйста, введите гос. номер автомобиля (например, `1234AB7`).")
+    await message.answer(ENTER_CAR_NUMBER_TEXT)
 
 
 # 👇 ИСПРАВЛЕННЫЙ ДЕКОРАТОР
-@router.message(F.text == "❌ Удалить все авто")
-@router.message(Command("delete"))
+@router.message(F.text == "❌ Удалить все авто", flags={"authorized": True})
+@router.message(Command("delete"), flags={"authorized": True})
 async def handle_delete_command(message: Message):
     """
     Удаляет все автомобили пользователя из базы данных.
     """
-    if not await db.is_user_authorized(message.from_user.id):
-        await message.answer("Пожалуйста, сначала пройдите авторизацию. Отправьте команду /start.")
-        return
-
     await db.delete_all_cars(message.from_user.id)
     await message.answer("✅ Все ваши автомобили были удалены из списка отслеживания.")
 
 
+@router.message(F.text == "📊 Очередь", flags={"authorized": True})
+@router.message(Command("queue"), flags={"authorized": True})
+async def handle_queue_command(message: Message):
+    """
+    Показывает состояние очереди без добавления машины.
+    Ответ собирается из сводок, посчитанных один раз на снимок: без запросов к API и БД.
+    """
+    await message.answer(format_queue_overview())
+
+
 # --- Обработчики состояний (FSM) ---
 
 @router.message(UserForm.waiting_for_token)
@@ -122,7 +205,7 @@ async def process_token(message: Message, state: FSMContext):
     Обрабатывает введенный токен доступа.
     """
     if message.text in config.valid_user_tokens:
-        await db.authorize_user(message.from_user.id)
+        await auth_cache.authorize_user(message.from_user.id)
         await state.clear()
         await message.answer(
             "✅ **Авторизация прошла успешно!**\n\n"
@@ -133,18 +216,59 @@ async def process_token(message: Message, state: FSMContext):
         await message.answer("❌ **Неверный токен.** Пожалуйста, попробуйте еще раз или запросите новый.")
 
 
-# ... (весь код до process_car_number без изменений) ...
+@router.callback_query(UserForm.waiting_for_checkpoint, CheckpointCallback.filter())
+async def process_checkpoint(callback: CallbackQuery, callback_data: CheckpointCallback, state: FSMContext):
+    """
+    Запоминает выбранный пункт пропуска и просит ввести номер
+    (или сразу добавляет номера, переданные в команде /add).
+    """
+    checkpoint = config.get_checkpoint(callback_data.checkpoint_id)
+    if checkpoint is None:
+        await callback.answer("Этот пункт пропуска больше не обслуживается.", show_alert=True)
+        return
+
+    await callback.answer()
+    await callback.message.edit_text(f"🛂 Пункт пропуска: **{checkpoint.name}**")
+
+    car_numbers = (await state.get_data()).get("pending_car_numbers")
+    if car_numbers:
+        await _add_cars(callback.message, state, callback.from_user.id, checkpoint.id, car_numbers)
+        return
+
+    await state.update_data(checkpoint_id=checkpoint.id)
+    await state.set_state(UserForm.waiting_for_car_number)
+    await callback.message.answer(ENTER_CAR_NUMBER_TEXT)
+
+
 @router.message(UserForm.waiting_for_car_number)
-async def process_car_number(message: Message, state: FSMContext, bot: Bot):
+async def process_car_number(message: Message, state: FSMContext):
     """
-    Обрабатывает введенный номер автомобиля, добавляет его в БД и запускает первую проверку.
+    Обрабатывает введенные номера автомобилей, добавляет их в БД и запускает первую проверку.
     """
-    car_number = message.text.upper().replace(" ", "")
-    
-    try:
-        # Убрали IGNORE, чтобы отловить ошибку, если номер уже есть
-        await db.add_car(message.from_user.id, car_number)
-    except Exception:
+    car_numbers = parse_car_numbers(message.text or "")
+    data = await state.get_data()
+    checkpoint_id = data.get("checkpoint_id", config.checkpoints[0].id)
+
+    if not car_numbers:
+        await message.answer(ENTER_CAR_NUMBER_TEXT)
+        return
+    if len(car_numbers) > MAX_CARS_PER_MESSAGE:
+        await message.answer(f"❌ За один раз можно добавить не больше {MAX_CARS_PER_MESSAGE} номеров.")
+        return
+
+    await _add_cars(message, state, message.from_user.id, checkpoint_id, car_numbers)
+
+
+async def _add_cars(message: Message, state: FSMContext, user_id: int, checkpoint_id: str, car_numbers: List[str]):
+    """Один номер - с подробной карточкой, несколько - одной сводкой."""
+    if len(car_numbers) > 1:
+        await state.clear()
+        await _add_many_cars(message, user_id, checkpoint_id, car_numbers)
+        return
+
+    car_number = car_numbers[0]
+    # add_cars возвращает только вставленные номера: чужой номер не перезапишет карточку владельца
+    if not await db.add_cars(user_id, checkpoint_id, [car_number]):
         await message.answer(f"❌ Не удалось добавить номер `{car_number}`. Возможно, он уже отслеживается другим пользователем. Проверьте список командой `/mycars`.")
         await state.clear()
         return
@@ -152,8 +276,36 @@ async def process_car_number(message: Message, state: FSMContext, bot: Bot):
     await message.answer(f"✅ Номер `{car_number}` добавлен. Начинаю отслеживание...")
     await state.clear()
     
-    await check_and_notify_user(bot, message.from_user.id, car_number, is_initial_check=True)
-    await message.answer("Вы можете посмотреть статус авто в любой момент.", reply_markup=get_main_menu_keyboard())
+    await check_and_notify_user(user_id, checkpoint_id, car_number, is_initial_check=True)
+    # Через ту же очередь, чтобы подсказка пришла после карточки авто
+    await outbox.send(message.chat.id, "Вы можете посмотреть статус авто в любой момент.", reply_markup=get_main_menu_keyboard())
+
+
+def parse_car_numbers(text: str) -> List[str]:
+    """Номера из сообщения: через запятую, точку с запятой или с новой строки; пробелы внутри номера убираются."""
+    car_numbers = (item.upper().replace(" ", "") for item in re.split(r"[,;\n]+", text))
+    return list(dict.fromkeys(car_number for car_number in car_numbers if car_number))
+
+
+async def _add_many_cars(message: Message, user_id: int, checkpoint_id: str, car_numbers: List[str]):
+    """Массовое добавление: одна сводка вместо карточки на каждую машину."""
+    found, missing, duplicates, unchecked = await start_tracking(user_id, checkpoint_id, car_numbers)
+
+    reply = f"✅ Добавлено и отслеживается: **{len(found)}**"
+    if found:
+        reply += "\n" + ", ".join(f"`{car_number}`" for car_number in found)
+    if missing:
+        reply += "\n\n❌ Не найдены в очереди: " + ", ".join(f"`{car_number}`" for car_number in missing)
+    if unchecked:
+        reply += (
+            "\n\n⏳ Нет данных об очереди, проверю при следующем обновлении: "
+            + ", ".join(f"`{car_number}`" for car_number in unchecked)
+        )
+    if duplicates:
+        reply += "\n\nℹ️ Уже отслеживаются: " + ", ".join(f"`{car_number}`" for car_number in duplicates)
+    reply += "\n\nСводка по всем авто - командой `/mycars`."
+    await message.answer(reply, reply_markup=get_main_menu_keyboard())
+
 # ... (остальной код без изменений) ...
 
 # --- "Всеядный" обработчик ---
@@ -0,0 +1,297 @@
+# history.py
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import aiosqlite
+
+from queue_model import QueueCar
+from snapshot_diff import SnapshotDiff
+
+logger = logging.getLogger(__name__)
+
+# Флаги в events.kind: одна строка на (снимок, машина), изменения объединяются по OR
+KIND_KEYFRAME = 1
+KIND_APPEARED = 2
+KIND_DISAPPEARED = 4
+KIND_STATUS = 8
+KIND_ORDER = 16
+
+# Полный снимок пишется раз в столько снимков, между ними - только изменения
+KEYFRAME_EVERY = 100
+# Как часто удалять устаревшую историю
+PRUNE_EVERY_SECONDS = 3600
+
+# Все значения - целые числа фиксированной ширины; номер хранится один раз в словаре regnums
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS regnums (id INTEGER PRIMARY KEY, regnum TEXT NOT NULL UNIQUE)",
+    """CREATE TABLE IF NOT EXISTS snapshots (
+        id INTEGER PRIMARY KEY,
+        checkpoint_id TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        is_keyframe INTEGER NOT NULL,
+        total_cars INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_snapshots_checkpoint_ts ON snapshots (checkpoint_id, ts)",
+    """CREATE TABLE IF NOT EXISTS events (
+        snapshot_id INTEGER NOT NULL,
+        regnum_id INTEGER NOT NULL,
+        kind INTEGER NOT NULL,
+        order_id INTEGER,
+        status INTEGER,
+        event_ts INTEGER,
+        PRIMARY KEY (snapshot_id, regnum_id)
+    ) WITHOUT ROWID""",
+)
+
+# (checkpoint_id, ts, индекс снимка, разница с предыдущим записанным снимком)
+HistoryItem = Tuple[str, int, Dict[str, QueueCar], Optional[SnapshotDiff]]
+
+
+class SnapshotHistory:
+    """
+    Append-only история снимков очереди в отдельной SQLite-базе.
+
+    Хранятся не JSON-снимки, а изменения между ними (с периодическими полными
+    снимками-keyframe), что позволяет восстановить очередь на любой момент.
+    Запись идет в фоновой задаче: record() только кладет снимок в очередь и не блокирует тик.
+    """
+    def __init__(self, db_name: str, retention_seconds: float, max_pending: int = 100):
+        self.db_name = db_name
+        self.retention_seconds = retention_seconds
+        self._pending: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._regnum_ids: Dict[str, int] = {}
+        self._since_keyframe: Dict[str, int] = {}
+        # Пункты пропуска, у которых снимок потерян при переполнении очереди
+        self._force_keyframe: Set[str] = set()
+        self._last_prune = 0.0
+
+    async def start(self):
+        self._conn = await aiosqlite.connect(self.db_name)
+        # auto_vacuum действует, только если задан до WAL и до создания таблиц
+        await self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor = await self._conn.execute("PRAGMA auto_vacuum")
+        if (await cursor.fetchone())[0] == 0:
+            # База создана без него: один раз перестраиваем файл, чтобы режим включился
+            logger.info(f"Enabling incremental auto_vacuum for {self.db_name}")
+            await self._conn.execute("VACUUM")
+        await self._conn.execute("PRAGMA journal_mode=WAL")
+        await self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            await self._conn.execute(statement)
+        await self._conn.commit()
+        cursor = await self._conn.execute("SELECT regnum, id FROM regnums")
+        self._regnum_ids = dict(await cursor.fetchall())
+        self._task = asyncio.create_task(self._writer(), name="history-writer")
+
+    async def stop(self):
+        if self._task is not None:
+            # Дописываем то, что уже в очереди, и останавливаем писателя
+            await self._pending.join()
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    def record(self, checkpoint_id: str, index: Dict[str, QueueCar], diff: Optional[SnapshotDiff]):
+        """
+        Ставит снимок в очередь на запись. diff - разница с предыдущим записанным снимком
+        этого пункта пропуска (None для первого снимка).
+        """
+        if self._task is None:
+            return
+        if checkpoint_id in self._force_keyframe:
+            # Предыдущий снимок потерян, diff отсчитан от него: пишем этот снимок целиком
+            diff = None
+        item = (checkpoint_id, int(time.time()), index, diff)
+        try:
+            self._pending.put_nowait(item)
+        except asyncio.QueueFull:
+            # Писатель не успевает: теряем снимок, а следующий пишем целиком, чтобы цепочка не порвалась.
+            # Флаг снимается только вместе с постановкой keyframe в очередь, поэтому снимки,
+            # которые уже ждут записи, его не сбросят
+            logger.warning(f"History queue is full, snapshot for {checkpoint_id} dropped")
+            self._force_keyframe.add(checkpoint_id)
+            return
+        self._force_keyframe.discard(checkpoint_id)
+
+    async def _regnum_id(self, regnum: str) -> int:
+        regnum_id = self._regnum_ids.get(regnum)
+        if regnum_id is None:
+            # Писатель один, поэтому словарь в памяти всегда совпадает с таблицей
+            cursor = await self._conn.execute("INSERT INTO regnums (regnum) VALUES (?)", (regnum,))
+            regnum_id = self._regnum_ids[regnum] = cursor.lastrowid
+        return regnum_id
+
+    async def _writer(self):
+        while True:
+            item = await self._pending.get()
+            try:
+                await self._write(item)
+                if time.monotonic() - self._last_prune > PRUNE_EVERY_SECONDS:
+                    await self.prune()
+            except Exception as e:
+                logger.error(f"Failed to write history for {item[0]}: {e}")
+                # Откатываем и начинаем цепочку заново с keyframe
+                await self._conn.rollback()
+                cursor = await self._conn.execute("SELECT regnum, id FROM regnums")
+                self._regnum_ids = dict(await cursor.fetchall())
+                self._since_keyframe.pop(item[0], None)
+            finally:
+                self._pending.task_done()
+
+    async def _write(self, item: HistoryItem):
+        checkpoint_id, ts, index, diff = item
+        since_keyframe = self._since_keyframe.get(checkpoint_id)
+        is_keyframe = diff is None or since_keyframe is None or since_keyframe >= KEYFRAME_EVERY
+
+        rows: Dict[str, List] = {}
+        if is_keyframe:
+            for regnum, car in index.items():
+                rows[regnum] = [KIND_KEYFRAME, car.order_id, car.status, car.registered_at]
+            if diff is not None:
+                # Изменения в keyframe-снимке тоже отмечаем, иначе get_events и count_called их не увидят
+                for regnum in diff.appeared:
+                    rows[regnum][0] |= KIND_APPEARED
+                for regnum in diff.disappeared:
+                    rows[regnum] = [KIND_DISAPPEARED, None, None, None]
+                for regnum in diff.status_changed:
+                    rows[regnum][0] |= KIND_STATUS
+                for regnum in diff.order_changed:
+                    rows[regnum][0] |= KIND_ORDER
+        else:
+            for regnum in diff.appeared:
+                car = index[regnum]
+                rows[regnum] = [KIND_APPEARED, car.order_id, car.status, car.registered_at]
+            for regnum in diff.disappeared:
+                rows[regnum] = [KIND_DISAPPEARED, None, None, None]
+            for regnum, (_, new_status) in diff.status_changed.items():
+                row = rows.setdefault(regnum, [0, None, None, None])
+                row[0] |= KIND_STATUS
+                row[2] = new_status
+                row[3] = index[regnum].changed_at
+            for regnum, (_, new_pos, _) in diff.order_changed.items():
+                row = rows.setdefault(regnum, [0, None, None, None])
+                row[0] |= KIND_ORDER
+                row[1] = new_pos
+
+        cursor = await self._conn.execute(
+            "INSERT INTO snapshots (checkpoint_id, ts, is_keyframe, total_cars) VALUES (?, ?, ?, ?)",
+            (checkpoint_id, ts, int(is_keyframe), len(index))
+        )
+        snapshot_id = cursor.lastrowid
+        await self._conn.executemany(
+            "INSERT INTO events (snapshot_id, regnum_id, kind, order_id, status, event_ts) VALUES (?, ?, ?, ?, ?, ?)",
+            [(snapshot_id, await self._regnum_id(regnum), *row) for regnum, row in rows.items()]
+        )
+        await self._conn.commit()
+        self._since_keyframe[checkpoint_id] = 0 if is_keyframe else since_keyframe + 1
+
+    async def get_snapshots(self, checkpoint_id: str, start_ts: int, end_ts: int) -> List[Tuple[int, int, int]]:
+        """Снимки за период: (snapshot_id, ts, total_cars)."""
+        cursor = await self._conn.execute(
+            "SELECT id, ts, total_cars FROM snapshots WHERE checkpoint_id = ? AND ts BETWEEN ? AND ? ORDER BY id",
+            (checkpoint_id, start_ts, end_ts)
+        )
+        return await cursor.fetchall()
+
+    async def get_events(
+        self,
+        checkpoint_id: str,
+        start_ts: int,
+        end_ts: int,
+        regnum: Optional[str] = None
+    ) -> List[Tuple[int, str, int, Optional[int], Optional[int], Optional[int]]]:
+        """
+        Изменения за период (keyframe-строки - только с изменениями): (ts, regnum, kind, order_id, status, event_ts).
+        С regnum - только по одной машине, например чтобы разобрать жалобу на пропущенное уведомление.
+        """
+        sql = (
+            "SELECT s.ts, r.regnum, e.kind, e.order_id, e.status, e.event_ts "
+            "FROM snapshots s JOIN events e ON e.snapshot_id = s.id JOIN regnums r ON r.id = e.regnum_id "
+            "WHERE s.checkpoint_id = ? AND s.ts BETWEEN ? AND ? AND (e.kind & ~?) != 0"
+        )
+        params = [checkpoint_id, start_ts, end_ts, KIND_KEYFRAME]
+        if regnum is not None:
+            sql += " AND r.regnum = ?"
+            params.append(regnum)
+        cursor = await self._conn.execute(sql + " ORDER BY s.id", params)
+        return await cursor.fetchall()
+
+    async def count_called(self, checkpoint_id: str, start_ts: int, end_ts: int) -> int:
+        """Сколько машин вызвано в ПП за период (переходы в статус 3)."""
+        cursor = await self._conn.execute(
+            "SELECT COUNT(*) FROM snapshots s JOIN events e ON e.snapshot_id = s.id "
+            "WHERE s.checkpoint_id = ? AND s.ts BETWEEN ? AND ? AND (e.kind & ?) AND e.status = 3",
+            (checkpoint_id, start_ts, end_ts, KIND_STATUS)
+        )
+        return (await cursor.fetchone())[0]
+
+    async def reconstruct(self, checkpoint_id: str, at_ts: int) -> Dict[str, Tuple[Optional[int], Optional[int]]]:
+        """Очередь на момент at_ts: regnum -> (order_id, status)."""
+        cursor = await self._conn.execute(
+            "SELECT MAX(id) FROM snapshots WHERE checkpoint_id = ? AND is_keyframe = 1 AND ts <= ?",
+            (checkpoint_id, at_ts)
+        )
+        keyframe_id = (await cursor.fetchone())[0]
+        if keyframe_id is None:
+            return {}
+        cursor = await self._conn.execute(
+            "SELECT r.regnum, e.kind, e.order_id, e.status "
+            "FROM snapshots s JOIN events e ON e.snapshot_id = s.id JOIN regnums r ON r.id = e.regnum_id "
+            "WHERE s.checkpoint_id = ? AND s.id >= ? AND s.ts <= ? ORDER BY s.id",
+            (checkpoint_id, keyframe_id, at_ts)
+        )
+        queue: Dict[str, Tuple[Optional[int], Optional[int]]] = {}
+        # Берется последний keyframe до at_ts, поэтому дальше идут только изменения
+        for regnum, kind, order_id, status in await cursor.fetchall():
+            if kind & KIND_KEYFRAME:
+                queue[regnum] = (order_id, status)
+            elif kind & KIND_DISAPPEARED:
+                queue.pop(regnum, None)
+            else:
+                old_order, old_status = queue.get(regnum, (None, None))
+                queue[regnum] = (
+                    order_id if kind & (KIND_ORDER | KIND_APPEARED) else old_order,
+                    status if kind & (KIND_STATUS | KIND_APPEARED) else old_status
+                )
+        return queue
+
+    async def prune(self):
+        """
+        Удаляет историю старше retention_seconds. Граница сдвигается к ближайшему
+        более старому keyframe, чтобы оставшиеся изменения было от чего отсчитывать.
+        """
+        self._last_prune = time.monotonic()
+        cutoff = int(time.time() - self.retention_seconds)
+        cursor = await self._conn.execute(
+            "SELECT checkpoint_id, MAX(id) FROM snapshots WHERE is_keyframe = 1 AND ts <= ? GROUP BY checkpoint_id",
+            (cutoff,)
+        )
+        deleted = 0
+        for checkpoint_id, keyframe_id in await cursor.fetchall():
+            await self._conn.execute(
+                "DELETE FROM events WHERE snapshot_id IN "
+                "(SELECT id FROM snapshots WHERE checkpoint_id = ? AND id < ?)",
+                (checkpoint_id, keyframe_id)
+            )
+            result = await self._conn.execute(
+                "DELETE FROM snapshots WHERE checkpoint_id = ? AND id < ?", (checkpoint_id, keyframe_id)
+            )
+            deleted += result.rowcount
+        if deleted:
+            # Компактизация: номера, которых больше нет в истории, и освободившиеся страницы
+            await self._conn.execute(
+                "DELETE FROM regnums WHERE id NOT IN (SELECT DISTINCT regnum_id FROM events)"
+            )
+            await self._conn.commit()
+            cursor = await self._conn.execute("SELECT regnum, id FROM regnums")
+            self._regnum_ids = dict(await cursor.fetchall())
+            await self._conn.execute("PRAGMA incremental_vacuum")
+            logger.info(f"History pruned: {deleted} snapshots older than {self.retention_seconds:.0f}s removed")
+        await self._conn.commit()
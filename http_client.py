@@ -0,0 +1,195 @@
+# http_client.py
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from typing import Any, Dict, NamedTuple, Optional
+
+import aiohttp
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:  # orjson необязателен, без него используем стандартный json
+    json_loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+# Статусы, при которых имеет смысл повторить запрос
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: upstream недавно падал несколько раз подряд."""
+
+
+class _NotModified:
+    def __repr__(self):
+        return "NOT_MODIFIED"
+
+
+# Ответ условного запроса: с прошлого раза по этому URL ничего не изменилось
+NOT_MODIFIED = _NotModified()
+
+
+class _Validators(NamedTuple):
+    """Что известно о последнем ответе по URL: заголовки для условного запроса и отпечаток тела."""
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fingerprint: bytes
+
+
+class CircuitBreaker:
+    """
+    Простой автомат closed -> open -> half-open.
+    После failure_threshold ошибок подряд запросы отклоняются сразу,
+    через reset_timeout секунд пропускается одна пробная попытка.
+    """
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def before_request(self):
+        if self._opened_at is None:
+            return
+        if time.monotonic() - self._opened_at < self.reset_timeout or self._probe_in_flight:
+            raise CircuitOpenError("Circuit breaker is open")
+        # half-open: пропускаем одну пробную попытку
+        self._probe_in_flight = True
+
+    def record_success(self):
+        if self._opened_at is not None:
+            logger.info("Circuit breaker closed, upstream is back")
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._probe_in_flight = False
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            if self._opened_at is None:
+                logger.warning(f"Circuit breaker opened after {self._failures} failures")
+            self._opened_at = time.monotonic()
+
+
+class BorderApiClient:
+    """
+    Долгоживущий HTTP-клиент к API погранперехода: пул соединений с keep-alive,
+    явные таймауты, повторы с экспоненциальной задержкой и circuit breaker.
+    Создается и закрывается в bot.main.
+    """
+    def __init__(
+        self,
+        connect_timeout: float,
+        read_timeout: float,
+        retries: int,
+        backoff_base: float,
+        backoff_max: float,
+        breaker: CircuitBreaker,
+        pool_size: int = 10
+    ):
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker
+        self.pool_size = pool_size
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._validators: Dict[str, _Validators] = {}
+        # Валидаторы последнего разобранного ответа, которые вызывающий еще не подтвердил (accept)
+        self._unconfirmed: Dict[str, _Validators] = {}
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _backoff(self, attempt: int) -> float:
+        # Экспоненциальная задержка с полным джиттером
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def accept(self, url: str):
+        """
+        Вызывающий принял последний ответ по url: дальше условные запросы сравниваются с ним.
+        Неподтвержденный ответ (например, JSON без нужных данных) не станет базой для NOT_MODIFIED.
+        """
+        validators = self._unconfirmed.pop(url, None)
+        if validators is not None:
+            self._validators[url] = validators
+
+    async def get_json(self, url: str, conditional: bool = False) -> Any:
+        """
+        GET-запрос с разбором JSON. После исчерпания повторов пробрасывает
+        последнюю ошибку, при открытом breaker'е - CircuitOpenError.
+
+        conditional=True: отправляет If-None-Match/If-Modified-Since, если сервер
+        их раньше присылал, и возвращает NOT_MODIFIED на 304 или на тело,
+        байт в байт совпадающее с прошлым принятым (accept) ответом (JSON в этом случае не разбирается).
+        """
+        self.breaker.before_request()
+        if self._session is None or self._session.closed:
+            await self.start()
+
+        headers = {}
+        known = self._validators.get(url) if conditional else None
+        if known is not None:
+            if known.etag:
+                headers["If-None-Match"] = known.etag
+            if known.last_modified:
+                headers["If-Modified-Since"] = known.last_modified
+
+        last_error: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self._backoff(attempt - 1))
+            try:
+                async with self._session.get(url, headers=headers) as response:
+                    if response.status == 304 and known is not None:
+                        self.breaker.record_success()
+                        return NOT_MODIFIED
+                    if response.status in RETRYABLE_STATUSES:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history,
+                            status=response.status, message=response.reason or ""
+                        )
+                    response.raise_for_status()
+                    body = await response.read()
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+                fingerprint = hashlib.blake2b(body, digest_size=16).digest()
+                if known is not None and known.fingerprint == fingerprint:
+                    self.breaker.record_success()
+                    return NOT_MODIFIED
+                try:
+                    data = json_loads(body)
+                except ValueError:
+                    self.breaker.record_failure()
+                    raise
+                self.breaker.record_success()
+                self._unconfirmed[url] = _Validators(etag, last_modified, fingerprint)
+                return data
+            except aiohttp.ClientResponseError as e:
+                last_error = e
+                if e.status not in RETRYABLE_STATUSES:
+                    break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+            logger.warning(f"API request attempt {attempt + 1}/{self.retries + 1} failed: {type(last_error).__name__}: {last_error}")
+
+        self.breaker.record_failure()
+        raise last_error
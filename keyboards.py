@@ -1,5 +1,22 @@
 # keyboards.py
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+
+from config import Checkpoint
+
+
+class CheckpointCallback(CallbackData, prefix="cp"):
+    checkpoint_id: str
+
+
+class FleetPageCallback(CallbackData, prefix="fleet"):
+    page: int
+
+
+class CarDetailCallback(CallbackData, prefix="car"):
+    checkpoint_id: str
+    regnum: str
+
 
 def get_main_menu_keyboard() -> ReplyKeyboardMarkup:
     """
@@ -11,6 +28,7 @@ def get_main_menu_keyboard() -> ReplyKeyboardMarkup:
             KeyboardButton(text="✅ Добавить авто")
         ],
         [
+            KeyboardButton(text="📊 Очередь"),
             KeyboardButton(text="❌ Удалить все авто")
         ]
     ]
@@ -20,4 +38,40 @@ def get_main_menu_keyboard() -> ReplyKeyboardMarkup:
         keyboard=buttons,
         resize_keyboard=True,
         one_time_keyboard=False
-    )
\ No newline at end of file
+    )
+
+
+def get_checkpoints_keyboard(checkpoints: list[Checkpoint]) -> InlineKeyboardMarkup:
+    """
+    Создает Inline-клавиатуру для выбора пункта пропуска.
+    """
+    buttons = [
+        [InlineKeyboardButton(text=checkpoint.name, callback_data=CheckpointCallback(checkpoint_id=checkpoint.id).pack())]
+        for checkpoint in checkpoints
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def get_fleet_keyboard(cars: list[tuple[str, str]], page: int, pages: int) -> InlineKeyboardMarkup:
+    """
+    Создает Inline-клавиатуру для сводки по автопарку:
+    кнопки подробностей по машинам страницы (checkpoint_id, regnum) и переключение страниц.
+    """
+    car_buttons = [
+        InlineKeyboardButton(
+            text=f"🔎 {regnum}",
+            callback_data=CarDetailCallback(checkpoint_id=checkpoint_id, regnum=regnum).pack()
+        )
+        for checkpoint_id, regnum in cars
+    ]
+    # По две машины в ряд
+    buttons = [car_buttons[i:i + 2] for i in range(0, len(car_buttons), 2)]
+    if pages > 1:
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(text="◀️", callback_data=FleetPageCallback(page=page - 1).pack()))
+        navigation.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=FleetPageCallback(page=page).pack()))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton(text="▶️", callback_data=FleetPageCallback(page=page + 1).pack()))
+        buttons.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -0,0 +1,281 @@
+# metrics.py
+import functools
+import inspect
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, в секундах
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение. Вместо set() можно передать callback: он вызывается при каждом
+    снятии метрик и возвращает пары (значения меток, число).
+    """
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        callback: Optional[Callable[[], Iterable[Tuple[LabelValues, float]]]] = None
+    ):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def samples(self) -> List[str]:
+        values = dict(self._values)
+        if self.callback is not None:
+            try:
+                values.update((tuple(map(str, key)), value) for key, value in self.callback())
+            except Exception as e:
+                logger.error(f"Gauge {self.name} callback failed: {e!r}")
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Значения меток -> [счетчики по корзинам..., сумма, количество]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    def time(self, **labels) -> "_Timer":
+        """Контекстный менеджер: with histogram.time(method="x"): ..."""
+        return _Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, state in self._values.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {_format_value(cumulative)}")
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {_format_value(state[-1])}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = (), callback=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labels, callback))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.render().encode(), headers={"Content-Type": PROMETHEUS_CONTENT_TYPE})
+
+    async def start_server(self, host: str, port: int):
+        """HTTP-эндпоинт /metrics в том же event loop, что и бот."""
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+
+    async def stop_server(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+registry = MetricsRegistry()
+
+API_REQUESTS = registry.counter("border_api_requests_total", "Requests to the border queue API", ("checkpoint", "result"))
+API_LATENCY = registry.histogram("border_api_request_seconds", "Border queue API request latency", ("checkpoint",))
+DB_QUERIES = registry.counter("db_queries_total", "Database method calls", ("method", "result"))
+DB_LATENCY = registry.histogram("db_query_seconds", "Database method latency", ("method",))
+TELEGRAM_REQUESTS = registry.counter("telegram_requests_total", "Bot API calls from the outbox", ("method", "result"))
+TELEGRAM_LATENCY = registry.histogram("telegram_request_seconds", "Bot API call latency", ("method",))
+TICKS = registry.counter("scheduler_ticks_total", "Scheduler ticks", ("result",))
+CHECKS = registry.counter("scheduler_checks_total", "Checkpoint checks by outcome (processed, skipped, failed)", ("checkpoint", "result"))
+TICK_LATENCY = registry.histogram("scheduler_tick_seconds", "Whole scheduled_job duration")
+TICK_PHASE_LATENCY = registry.histogram("scheduler_phase_seconds", "Checkpoint check duration by phase", ("phase",))
+WEBHOOK_UPDATES = registry.counter("webhook_updates_total", "Updates received by the webhook endpoint", ("result",))
+WEBHOOK_UPDATE_LATENCY = registry.histogram("webhook_update_seconds", "Time to process one webhook update")
+TRACKED_CARS = registry.gauge("tracked_cars", "Tracked cars per checkpoint", ("checkpoint",))
+QUEUE_LENGTH = registry.gauge("queue_length", "Cars in the border queue per checkpoint", ("checkpoint",))
+
+
+def instrument_methods(histogram: Histogram, counter: Counter):
+    """
+    Декоратор класса: оборачивает все публичные async-методы замером времени
+    и счетчиком вызовов с меткой method.
+    """
+    def wrap(method: Callable) -> Callable:
+        name = method.__name__
+
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            result = "error"
+            try:
+                value = await method(*args, **kwargs)
+                result = "ok"
+                return value
+            finally:
+                histogram.observe(time.perf_counter() - started, method=name)
+                counter.inc(method=name, result=result)
+        return wrapper
+
+    def decorate(cls):
+        for name, member in list(vars(cls).items()):
+            if not name.startswith("_") and inspect.iscoroutinefunction(member):
+                setattr(cls, name, wrap(member))
+        return cls
+    return decorate
+
+
+class PhaseTimer:
+    """
+    Разбивка одной проверки пункта пропуска по фазам.
+    mark(phase) закрывает фазу, начавшуюся с предыдущей отметки.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: Dict[str, float] = {}
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    @property
+    def total(self) -> float:
+        return self._last - self.started
+
+    def finish(self, slow_threshold: float):
+        """Пишет фазы в гистограмму и, если проверка дольше порога, в лог."""
+        for phase, seconds in self.phases.items():
+            TICK_PHASE_LATENCY.observe(seconds, phase=phase)
+        if slow_threshold > 0 and self.total >= slow_threshold:
+            breakdown = ", ".join(f"{phase}={seconds * 1000:.0f}ms" for phase, seconds in self.phases.items())
+            logger.warning(f"Slow tick for {self.name}: {self.total * 1000:.0f}ms ({breakdown})")
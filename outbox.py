@@ -0,0 +1,305 @@
+# outbox.py
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from metrics import TELEGRAM_LATENCY, TELEGRAM_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Результат попытки отправки, после которой сообщение нужно повторить
+_RETRY = object()
+
+
+class Priority(IntEnum):
+    """Чем меньше значение, тем раньше сообщение уйдет из очереди."""
+    URGENT = 0  # вызов в ПП
+    NORMAL = 1  # продвижение очереди, ответы на команды
+    LOW = 2     # служебные уведомления
+
+
+class TokenBucket:
+    """
+    Token bucket с резервированием: reserve() сразу списывает токен
+    и возвращает, сколько секунд нужно подождать до отправки.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+# (приоритет, порядковый номер, сообщение) - элемент очереди воркеров
+_Entry = Tuple[int, int, "OutgoingMessage"]
+
+
+@dataclass
+class _ChatState:
+    """
+    Сообщения в один чат уходят по порядку: пока active отправляется или ждет лимита чата,
+    следующие сообщения этого чата лежат в backlog и не занимают воркеров.
+    """
+    bucket: TokenBucket
+    active: Optional["OutgoingMessage"] = None
+    # Токен чата для active уже списан (сообщение отложено до момента, когда лимит позволит)
+    reserved: bool = False
+    timer: Optional[asyncio.TimerHandle] = None
+    backlog: Deque[_Entry] = field(default_factory=deque)
+
+
+@dataclass
+class OutgoingMessage:
+    """
+    Новое сообщение или, если задан edit_message_id, правка уже отправленного.
+    В future попадает результат: message_id нового сообщения / True для правки, None при неудаче.
+    """
+    chat_id: int
+    text: str
+    kwargs: Dict[str, Any]
+    edit_message_id: Optional[int] = None
+    future: Optional[asyncio.Future] = None
+    attempt: int = 0
+
+
+class MessageDispatcher:
+    """
+    Очередь исходящих сообщений Telegram: несколько воркеров, общий лимит
+    и лимит на чат (token bucket), приоритеты, обработка RetryAfter
+    и ограниченный размер очереди.
+
+    Воркер не ждет лимита отдельного чата: такое сообщение откладывается по таймеру
+    и возвращается в очередь со своим приоритетом, а воркер берет следующее. Поэтому
+    один чат, в который уходит много сообщений, не задерживает остальных.
+    """
+    def __init__(
+        self,
+        workers: int,
+        max_queue_size: int,
+        global_rate: float,
+        chat_rate: float,
+        chat_burst: int,
+        max_retries: int = 3,
+        max_chats: int = 10000
+    ):
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.max_queue_size = max_queue_size
+        # Очередь сама не ограничена: отложенные сообщения должны возвращаться в нее без ожидания,
+        # а размер ограничивает _capacity - число принятых и еще не отправленных сообщений
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._capacity = asyncio.Semaphore(max_queue_size)
+        self._pending = 0
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chats: "OrderedDict[int, _ChatState]" = OrderedDict()
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._bot: Optional[Bot] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def set_global_rate(self, rate: float):
+        """Общий лимит, когда один бот рассылает из нескольких процессов и лимит Telegram делится между ними."""
+        self._global_bucket = TokenBucket(rate, rate)
+
+    def start(self, bot: Bot):
+        self._bot = bot
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"outbox-worker-{i}"))
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Дает воркерам дослать очередь (не дольше drain_timeout) и останавливает их."""
+        try:
+            await asyncio.wait_for(self._queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Outbox stopped with {self._pending} unsent messages")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        # Неотправленные сообщения отбрасываем, но ожидающих их результата не оставляем висеть
+        unsent = []
+        while not self._queue.empty():
+            unsent.append(self._queue.get_nowait()[2])
+        for chat in self._chats.values():
+            if chat.timer is not None:
+                chat.timer.cancel()
+            if chat.active is not None:
+                unsent.append(chat.active)
+            unsent.extend(message for _, _, message in chat.backlog)
+        self._chats.clear()
+        self._queue = asyncio.PriorityQueue()
+        self._capacity = asyncio.Semaphore(self.max_queue_size)
+        self._pending = 0
+        for message in unsent:
+            if message.future is not None and not message.future.done():
+                message.future.set_result(None)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def send(self, chat_id: int, text: str, priority: Priority = Priority.NORMAL, **kwargs) -> asyncio.Future:
+        """
+        Ставит сообщение в очередь. Если очередь заполнена, ждет свободного места,
+        так что память ограничена, а производители естественно притормаживают.
+        Возвращает future с message_id отправленного сообщения (None, если отправить не удалось);
+        ждать его не обязательно.
+        """
+        return await self._enqueue(priority, OutgoingMessage(chat_id, text, kwargs))
+
+    async def edit(
+        self,
+        chat_id: int,
+        message_id: int,
+        text: str,
+        priority: Priority = Priority.LOW,
+        **kwargs
+    ) -> asyncio.Future:
+        """
+        Ставит в очередь правку сообщения; правки расходуют те же лимиты, что и отправка.
+        Future получает True, если сообщение изменено (или текст уже такой же), и None,
+        если править нечего (сообщение удалено, слишком старое и т.п.).
+        """
+        return await self._enqueue(priority, OutgoingMessage(chat_id, text, kwargs, edit_message_id=message_id))
+
+    async def _enqueue(self, priority: Priority, message: OutgoingMessage) -> asyncio.Future:
+        if self._bot is None:
+            raise RuntimeError("Outbox is not started, call start(bot) first")
+        message.future = asyncio.get_running_loop().create_future()
+        await self._capacity.acquire()
+        self._pending += 1
+        self._queue.put_nowait((priority, next(self._seq), message))
+        return message.future
+
+    def _chat(self, chat_id: int) -> _ChatState:
+        state = self._chats.get(chat_id)
+        if state is not None:
+            self._chats.move_to_end(chat_id)
+            return state
+        # Вытесняем давно не использованные чаты, чтобы словарь не рос бесконечно
+        while len(self._chats) >= self.max_chats:
+            oldest_id, oldest = next(iter(self._chats.items()))
+            if oldest.active is not None:
+                break
+            del self._chats[oldest_id]
+        state = self._chats[chat_id] = _ChatState(TokenBucket(self.chat_rate, self.chat_burst))
+        return state
+
+    def _requeue(self, entry: _Entry):
+        """Возвращает уже взятое из очереди сообщение обратно (после паузы или своей очереди в чате)."""
+        self._queue.put_nowait(entry)
+        self._queue.task_done()
+
+    async def _worker(self):
+        while True:
+            entry = await self._queue.get()
+            message = entry[2]
+            chat = self._chat(message.chat_id)
+            if chat.active is None:
+                chat.active = message
+            elif chat.active is not message:
+                # В чат уже отправляется другое сообщение: это подождет своей очереди без воркера
+                chat.backlog.append(entry)
+                continue
+            if not chat.reserved:
+                delay = chat.bucket.reserve()
+                if delay > 0:
+                    # Лимит чата: откладываем сообщение и берем следующее
+                    chat.reserved = True
+                    chat.timer = asyncio.get_running_loop().call_later(delay, self._requeue, entry)
+                    continue
+            chat.reserved = False
+            chat.timer = None
+
+            result = None
+            retry = False
+            try:
+                result = await self._deliver(message)
+                if result is _RETRY:
+                    result = None
+                    message.attempt += 1
+                    retry = message.attempt <= self.max_retries
+                    if not retry:
+                        logger.error(f"Message to {message.chat_id} dropped after {self.max_retries + 1} attempts")
+            except Exception as e:
+                logger.error(f"Failed to send message to {message.chat_id}: {e}")
+            if retry:
+                # Повтор идет через очередь и заново расходует лимит чата
+                self._requeue(entry)
+                continue
+
+            if message.future is not None and not message.future.done():
+                message.future.set_result(result)
+            self._pending -= 1
+            self._capacity.release()
+            if chat.backlog:
+                # Следующее сообщение чата сразу становится активным, чтобы новые не обогнали его
+                next_entry = chat.backlog.popleft()
+                chat.active = next_entry[2]
+                self._requeue(next_entry)
+            else:
+                chat.active = None
+            self._queue.task_done()
+
+    async def _deliver(self, message: OutgoingMessage) -> Any:
+        """Одна попытка отправки; _RETRY - Telegram попросил подождать, сообщение нужно повторить."""
+        # Пауза после RetryAfter и общий лимит действуют на всех воркеров сразу
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        delay = self._global_bucket.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        method = "send_message" if message.edit_message_id is None else "edit_message_text"
+        started = time.perf_counter()
+        result = "error"
+        try:
+            if message.edit_message_id is None:
+                sent = await self._bot.send_message(message.chat_id, message.text, **message.kwargs)
+                result = "ok"
+                return sent.message_id
+            await self._bot.edit_message_text(
+                message.text, chat_id=message.chat_id, message_id=message.edit_message_id, **message.kwargs
+            )
+            result = "ok"
+            return True
+        except TelegramRetryAfter as e:
+            result = "retry_after"
+            logger.warning(f"Flood limit hit, pausing outbox for {e.retry_after}s (attempt {message.attempt + 1})")
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            return _RETRY
+        except TelegramForbiddenError:
+            result = "forbidden"
+            logger.info(f"Chat {message.chat_id} blocked the bot, message dropped")
+            return None
+        except TelegramBadRequest as e:
+            if message.edit_message_id is not None and "message is not modified" in str(e):
+                result = "not_modified"
+                return True
+            result = "bad_request"
+            logger.error(f"Telegram API error for chat {message.chat_id}: {e}")
+            return None
+        except TelegramAPIError as e:
+            logger.error(f"Telegram API error for chat {message.chat_id}: {e}")
+            return None
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - started, method=method)
+            TELEGRAM_REQUESTS.inc(method=method, result=result)
@@ -0,0 +1,113 @@
+# queue_model.py
+import datetime
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import pytz
+
+from config import config
+
+TIMEZONE = pytz.timezone(config.timezone)
+DATE_FORMAT = "%H:%M:%S %d.%m.%Y"
+
+STATUS_CANCELLED = 1
+STATUS_ARRIVED = 2
+STATUS_CALLED = 3
+STATUS_MAP = {STATUS_CANCELLED: "Аннулирован", STATUS_ARRIVED: "Прибыл в ЗО", STATUS_CALLED: "Вызван в ПП"}
+# Короткие названия для таблицы в сводке по автопарку
+STATUS_SHORT = {STATUS_CANCELLED: "аннул.", STATUS_ARRIVED: "в ЗО", STATUS_CALLED: "ВЫЗВАН"}
+
+
+@lru_cache(maxsize=65536)
+def parse_queue_time(value: Optional[str]) -> Optional[int]:
+    """
+    Дата из API ("%H:%M:%S %d.%m.%Y", местное время) в unix-время.
+    Одна и та же машина приходит с той же датой в каждом опросе, поэтому результат мемоизируется.
+    """
+    if not value:
+        return None
+    # Формат фиксированный, поэтому разбираем срезами - это в разы быстрее strptime
+    try:
+        moment = datetime.datetime(
+            int(value[15:19]), int(value[12:14]), int(value[9:11]),
+            int(value[0:2]), int(value[3:5]), int(value[6:8])
+        )
+    except (ValueError, IndexError):
+        moment = datetime.datetime.strptime(value, DATE_FORMAT)
+    return int(TIMEZONE.localize(moment).timestamp())
+
+
+@lru_cache(maxsize=65536)
+def format_queue_time(ts: int) -> str:
+    """Обратное преобразование для вывода пользователю."""
+    return datetime.datetime.fromtimestamp(ts, TIMEZONE).strftime(DATE_FORMAT)
+
+
+class QueueCar:
+    """Машина из carLiveQueue, разобранная один раз: время - unix-секунды, статус - int."""
+    __slots__ = ("regnum", "order_id", "status", "registered_at", "changed_at")
+
+    def __init__(self, regnum: str, order_id: Optional[int], status: int, registered_at: Optional[int], changed_at: Optional[int]):
+        self.regnum = regnum
+        self.order_id = order_id
+        self.status = status
+        self.registered_at = registered_at
+        self.changed_at = changed_at
+
+    @property
+    def is_called(self) -> bool:
+        return self.status == STATUS_CALLED
+
+
+def decode_queue(raw_queue: List[Dict]) -> List[QueueCar]:
+    """Переводит JSON-очередь из API в список QueueCar."""
+    cars = []
+    append = cars.append
+    for car in raw_queue:
+        order_id = car.get("order_id")
+        append(QueueCar(
+            car["regnum"],
+            int(order_id) if order_id is not None else None,
+            int(car.get("status") or 0),
+            parse_queue_time(car.get("registration_date")),
+            parse_queue_time(car.get("changed_date"))
+        ))
+    return cars
+
+
+@dataclass
+class QueueStats:
+    """
+    Производные значения снимка, которые одинаковы для всех пользователей.
+    first_waiting_car - первая машина, еще не вызванная в ПП.
+    longest_waiting_car - невызванная машина, зарегистрированная раньше всех.
+    """
+    first_car: Optional[QueueCar] = None
+    first_waiting_car: Optional[QueueCar] = None
+    longest_waiting_car: Optional[QueueCar] = None
+    status_counts: Dict[int, int] = field(default_factory=dict)
+
+    @property
+    def called_count(self) -> int:
+        return self.status_counts.get(STATUS_CALLED, 0)
+
+
+def summarize_queue(cars: List[QueueCar]) -> QueueStats:
+    """Считает QueueStats за один проход по очереди."""
+    stats = QueueStats(first_car=cars[0] if cars else None)
+    counts = stats.status_counts
+    longest = None
+    for car in cars:
+        counts[car.status] = counts.get(car.status, 0) + 1
+        if car.is_called:
+            continue
+        if stats.first_waiting_car is None:
+            stats.first_waiting_car = car
+        # Аннулированные записи уже не ждут
+        if car.status != STATUS_CANCELLED and car.registered_at is not None and (
+            longest is None or car.registered_at < longest.registered_at
+        ):
+            longest = car
+    stats.longest_waiting_car = longest
+    return stats
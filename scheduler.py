@@ -0,0 +1,119 @@
+# scheduler.py
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Интервал опроса в зависимости от того, насколько близко к вызову ближайшая отслеживаемая машина:
+# (позиция не дальше, интервал в секундах)
+PROXIMITY_INTERVALS = (
+    (5, 0.0),     # почти у ПП - опрашиваем так часто, как разрешено
+    (20, 45.0),
+    (100, 120.0),
+    (500, 300.0),
+)
+# Во сколько раз увеличивать интервал после каждого тика без изменений
+IDLE_BACKOFF = 1.5
+# Дальше счетчик тиков без изменений не растет: множитель уже перекрывает любой интервал,
+# а без предела IDLE_BACKOFF ** n через несколько недель простоя переполнит float
+MAX_IDLE_TICKS = 30
+# Если отслеживаемая машина не дальше этой позиции, простой интервал не увеличивает:
+# вызов может случиться на любом следующем опросе
+IDLE_BACKOFF_MAX_POSITION = 20
+# Сколько опросов хотим успеть сделать, пока ближайшая машина дойдет до вызова
+POLLS_PER_ETA = 4
+
+
+@dataclass
+class TickReport:
+    """
+    Итог проверки одного пункта пропуска.
+    closest_position - ближайшая к вызову отслеживаемая машина (None, если никто не отслеживается),
+    cars_per_minute - сколько машин в минуту уходит из начала очереди.
+    """
+    changed: bool
+    closest_position: Optional[int] = None
+    cars_per_minute: float = 0.0
+
+
+class AdaptiveScheduler:
+    """
+    Запускает job в цикле без перекрытий: следующий тик начинается только после
+    завершения предыдущего. Интервал подбирается по отчетам тика: чаще, когда
+    отслеживаемая машина близко к вызову или очередь движется быстро, реже,
+    когда никто не близко или ничего не меняется. Всегда в пределах [min, max].
+    """
+    def __init__(
+        self,
+        job: Callable[[], Awaitable[List[TickReport]]],
+        min_interval: float,
+        max_interval: float
+    ):
+        self._job = job
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._idle_ticks = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="adaptive-scheduler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def next_interval(self, reports: List[TickReport]) -> float:
+        if not reports:
+            # Тик не удался (например, API недоступен) - пробуем снова, но без спешки
+            return self._clamp(self.max_interval / 2)
+
+        if any(report.changed for report in reports):
+            self._idle_ticks = 0
+        else:
+            self._idle_ticks = min(self._idle_ticks + 1, MAX_IDLE_TICKS)
+
+        interval = self.max_interval
+        for report in reports:
+            interval = min(interval, self._interval_for(report))
+        if not any(
+            report.closest_position is not None and report.closest_position <= IDLE_BACKOFF_MAX_POSITION
+            for report in reports
+        ):
+            interval *= IDLE_BACKOFF ** self._idle_ticks
+        return self._clamp(interval)
+
+    def _interval_for(self, report: TickReport) -> float:
+        if report.closest_position is None:
+            return self.max_interval
+        interval = self.max_interval
+        for max_position, proximity_interval in PROXIMITY_INTERVALS:
+            if report.closest_position <= max_position:
+                interval = proximity_interval
+                break
+        if report.cars_per_minute > 0:
+            # Очередь движется быстро - успеваем несколько раз опросить до вызова
+            eta_seconds = report.closest_position / report.cars_per_minute * 60
+            interval = min(interval, eta_seconds / POLLS_PER_ETA)
+        return interval
+
+    def _clamp(self, interval: float) -> float:
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                reports = await self._job()
+            except Exception as e:
+                logger.exception(f"Scheduled job failed: {e}")
+                reports = []
+            interval = self.next_interval(reports)
+            # Интервал считается от начала тика; долгий тик просто сдвигает следующий
+            delay = max(0.0, interval - (time.monotonic() - started))
+            logger.info(f"Next check in {delay:.0f}s (interval {interval:.0f}s)")
+            await asyncio.sleep(delay)
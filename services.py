@@ -1,149 +1,732 @@
 # services.py
+import asyncio
 import aiohttp
 import datetime
-import pytz
+import hashlib
 import logging
-from typing import Optional, Dict
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Dict, List, Set, Tuple
 
-from aiogram import Bot
 from database import db
-from config import config
+from config import Checkpoint, config
+from snapshot_cache import SnapshotCache
+from http_client import NOT_MODIFIED, BorderApiClient, CircuitBreaker, CircuitOpenError
+from outbox import MessageDispatcher, Priority
+from snapshot_diff import diff_snapshots
+from scheduler import TickReport
+from history import SnapshotHistory
+from eta import EtaTable, ThroughputEstimator
+from metrics import (
+    API_LATENCY, API_REQUESTS, CHECKS, QUEUE_LENGTH, TICK_LATENCY, TICKS, TRACKED_CARS, PhaseTimer, registry
+)
+from queue_model import (
+    STATUS_CALLED, STATUS_MAP, STATUS_SHORT, TIMEZONE, QueueCar, QueueStats,
+    decode_queue, format_queue_time, summarize_queue
+)
 
 logger = logging.getLogger(__name__)
-TIMEZONE = pytz.timezone(config.timezone)
+# Пороги уведомлений по ожидаемому времени до вызова, в минутах
+ETA_THRESHOLDS_MINUTES = (120, 60, 30, 15)
+# Сколько машин показывать на одной странице сводки по автопарку
+FLEET_PAGE_SIZE = 10
+# За какое время показывать число вызовов в сводке /queue, секунды
+QUEUE_SUMMARY_WINDOW = 3600
 
-# ... (функция format_car_info остается без изменений) ...
-def format_car_info(
-    user_car_data: Dict,
-    total_cars: int,
-    first_car_overall: Optional[Dict] = None,
-    first_waiting_car: Optional[Dict] = None
-) -> str:
-    status_map = {1: "Аннулирован", 2: "Прибыл в ЗО", 3: "Вызван в ПП"}
-    date_format = "%H:%M:%S %d.%m.%Y"
-    
-    info_text = f"🚗 **Всего машин в очереди: {total_cars}**\n\n"
 
-    user_status_text = status_map.get(user_car_data['status'], "Неизвестный статус")
-    user_reg_time = TIMEZONE.localize(datetime.datetime.strptime(user_car_data['registration_date'], date_format))
-    
-    info_text += (
-        f"🚙 **Ваш авто:** `{user_car_data['regnum']}`\n"
+def format_data_age(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} сек. назад"
+    return f"{seconds // 60} мин. назад"
+
+
+def format_eta(seconds: float) -> str:
+    minutes = max(int(seconds // 60), 1)
+    called_at = datetime.datetime.now(TIMEZONE) + datetime.timedelta(seconds=seconds)
+    duration = f"{minutes // 60} ч {minutes % 60} мин" if minutes >= 60 else f"{minutes} мин"
+    return f"~{duration} (около {called_at.strftime('%H:%M')})"
+
+
+def format_eta_clock(ts: float) -> str:
+    """Время вызова с точностью до 5 минут: живая карточка не должна меняться от каждой секунды."""
+    rounded = int(round(ts / 300)) * 300
+    return datetime.datetime.fromtimestamp(rounded, TIMEZONE).strftime("%H:%M")
+
+
+def format_duration(seconds: int) -> str:
+    return str(datetime.timedelta(seconds=seconds))
+
+
+def format_wait_short(seconds: int) -> str:
+    minutes = max(seconds, 0) // 60
+    return f"{minutes // 60}ч {minutes % 60:02d}м"
+
+
+def format_queue_header(total_cars: int, checkpoint_name: Optional[str] = None) -> str:
+    header = ""
+    if checkpoint_name:
+        header += f"🛂 **Пункт пропуска:** {checkpoint_name}\n"
+    return header + f"🚗 **Всего машин в очереди: {total_cars}**\n\n"
+
+
+def format_user_car(user_car_data: QueueCar, now: int, eta_seconds: Optional[float] = None) -> str:
+    user_status_text = STATUS_MAP.get(user_car_data.status, "Неизвестный статус")
+    user_reg_time = user_car_data.registered_at
+
+    info_text = (
+        f"🚙 **Ваш авто:** `{user_car_data.regnum}`\n"
         f"🚦 **Статус:** *{user_status_text}*\n"
     )
 
-    if user_car_data['status'] == 3:
-        changed_time = TIMEZONE.localize(datetime.datetime.strptime(user_car_data['changed_date'], date_format))
-        wait_time = changed_time - user_reg_time
-        info_text += f"⏱ **Время ожидания (до вызова):** `{str(wait_time).split('.')[0]}`\n"
+    if user_car_data.is_called:
+        wait_time = user_car_data.changed_at - user_reg_time
+        info_text += f"⏱ **Время ожидания (до вызова):** `{format_duration(wait_time)}`\n"
     else:
-        current_time = datetime.datetime.now(TIMEZONE)
-        wait_time = current_time - user_reg_time
+        wait_time = now - user_reg_time
+        info_text += f"📍 **Позиция в очереди:** `{user_car_data.order_id}`\n"
+        if eta_seconds is not None:
+            info_text += f"🕐 **Ожидаемый вызов:** `{format_eta(eta_seconds)}`\n"
         info_text += (
-            f"📍 **Позиция в очереди:** `{user_car_data['order_id']}`\n"
-            f"📅 **Зарегистрирован:** `{user_reg_time.strftime(date_format)}`\n"
-            f"⏳ **В очереди уже:** `{str(wait_time).split('.')[0]}`\n"
+            f"📅 **Зарегистрирован:** `{format_queue_time(user_reg_time)}`\n"
+            f"⏳ **В очереди уже:** `{format_duration(wait_time)}`\n"
         )
+    return info_text
 
-    if first_car_overall and first_car_overall.get('regnum') != user_car_data.get('regnum'):
-        info_text += "\n---\n"
-        reg_time = TIMEZONE.localize(datetime.datetime.strptime(first_car_overall['registration_date'], date_format))
-        
-        if first_car_overall['status'] == 3:
-            title = "🔝 Вызван в ПП"
-            changed_time = TIMEZONE.localize(datetime.datetime.strptime(first_car_overall['changed_date'], date_format))
-            wait_time_str = str(changed_time - reg_time).split('.')[0]
-            
-            info_text += (
-                f"**{title}:** `{first_car_overall['regnum']}`\n"
-                f"⏱ **Время в очереди:** `{wait_time_str}`\n"
-                f"📅 **Зарегистрирован:** `{reg_time.strftime(date_format)}`\n"
-                f"🔔 **Вызван:** `{changed_time.strftime(date_format)}`\n"
-            )
-        else:
-            title = "🔝 Первый в очереди"
-            current_time = datetime.datetime.now(TIMEZONE)
-            wait_time_str = str(current_time - reg_time).split('.')[0]
-            
-            info_text += (
-                f"**{title}:** `{first_car_overall['regnum']}`\n"
-                f"⏳ **Ожидает уже:** `{wait_time_str}`\n"
-                f"📅 **Зарегистрирован:** `{reg_time.strftime(date_format)}`\n"
-            )
 
-    if first_waiting_car and first_waiting_car.get('regnum') != user_car_data.get('regnum'):
-        info_text += "---\n"
-        reg_time = TIMEZONE.localize(datetime.datetime.strptime(first_waiting_car['registration_date'], date_format))
-        current_time = datetime.datetime.now(TIMEZONE)
-        wait_time_str = str(current_time - reg_time).split('.')[0]
-        
+def format_first_car(first_car_overall: QueueCar, now: int) -> str:
+    reg_time = first_car_overall.registered_at
+
+    if first_car_overall.is_called:
+        changed_time = first_car_overall.changed_at
+        return (
+            "\n---\n"
+            f"**🔝 Вызван в ПП:** `{first_car_overall.regnum}`\n"
+            f"⏱ **Время в очереди:** `{format_duration(changed_time - reg_time)}`\n"
+            f"📅 **Зарегистрирован:** `{format_queue_time(reg_time)}`\n"
+            f"🔔 **Вызван:** `{format_queue_time(changed_time)}`\n"
+        )
+    return (
+        "\n---\n"
+        f"**🔝 Первый в очереди:** `{first_car_overall.regnum}`\n"
+        f"⏳ **Ожидает уже:** `{format_duration(now - reg_time)}`\n"
+        f"📅 **Зарегистрирован:** `{format_queue_time(reg_time)}`\n"
+    )
+
+
+def format_waiting_car(first_waiting_car: QueueCar, now: int) -> str:
+    reg_time = first_waiting_car.registered_at
+    return (
+        "---\n"
+        f"👑 **Следующий на вызов:** `{first_waiting_car.regnum}`\n"
+        f"⏳ **Ожидает уже:** `{format_duration(now - reg_time)}`\n"
+        f"📅 **Зарегистрирован:** `{format_queue_time(reg_time)}`\n"
+    )
+
+
+def format_queue_summary(header: str, stats: QueueStats, now: int, recent_calls: Tuple[int, int]) -> str:
+    """
+    Сводка по очереди для /queue: количество по статусам, кто дольше всех ждет и сколько
+    машин вызвано за последний час. recent_calls - (вызовов, секунд наблюдения) из ThroughputEstimator.
+    """
+    info_text = header
+    for status, status_text in STATUS_MAP.items():
+        info_text += f"• {status_text}: `{stats.status_counts.get(status, 0)}`\n"
+    for status, count in sorted(stats.status_counts.items()):
+        if status not in STATUS_MAP:
+            info_text += f"• Статус {status}: `{count}`\n"
+
+    longest = stats.longest_waiting_car
+    if longest is not None:
         info_text += (
-            f"👑 **Следующий на вызов:** `{first_waiting_car['regnum']}`\n"
-            f"⏳ **Ожидает уже:** `{wait_time_str}`\n"
-            f"📅 **Зарегистрирован:** `{reg_time.strftime(date_format)}`\n"
+            f"\n⏳ **Дольше всех ждет:** `{longest.regnum}`\n"
+            f"📅 **Зарегистрирован:** `{format_queue_time(longest.registered_at)}` "
+            f"(`{format_duration(now - longest.registered_at)}`)\n"
         )
 
+    calls, observed = recent_calls
+    if observed >= QUEUE_SUMMARY_WINDOW:
+        info_text += f"🚦 **Вызвано в ПП за последний час:** `{calls}`\n"
+    elif observed >= 60:
+        # Бот наблюдает очередь меньше часа: показываем, сколько есть, и темп в пересчете на час
+        info_text += (
+            f"🚦 **Вызвано в ПП за последние {observed // 60} мин:** `{calls}` "
+            f"(~{calls / observed * 3600:.0f} в час)\n"
+        )
+    else:
+        info_text += "🚦 **Темп вызовов:** _пока недостаточно данных_\n"
+    return info_text
+
+
+def format_car_info(
+    user_car_data: QueueCar,
+    total_cars: int,
+    first_car_overall: Optional[QueueCar] = None,
+    first_waiting_car: Optional[QueueCar] = None,
+    data_age: Optional[float] = None,
+    checkpoint_name: Optional[str] = None,
+    eta_seconds: Optional[float] = None
+) -> str:
+    """
+    Карточка машины без привязки к снимку. Для машин из снимка дешевле QueueSnapshot.format_car_info:
+    общие блоки там рендерятся один раз на снимок.
+    """
+    # Все даты в QueueCar уже разобраны в unix-время при загрузке снимка
+    now = int(time.time())
+
+    info_text = format_queue_header(total_cars, checkpoint_name)
+    info_text += format_user_car(user_car_data, now, eta_seconds)
+
+    if first_car_overall and first_car_overall.regnum != user_car_data.regnum:
+        info_text += format_first_car(first_car_overall, now)
+
+    if first_waiting_car and first_waiting_car.regnum != user_car_data.regnum:
+        info_text += format_waiting_car(first_waiting_car, now)
+
+    if data_age is not None:
+        info_text += f"\n🕒 _Данные обновлены {format_data_age(data_age)}_\n"
+
     return info_text
 
 
-async def fetch_queue_data() -> Optional[Dict]:
+@dataclass
+class SnapshotSections:
+    """Части сообщения, которые зависят только от снимка, уже отрендеренные."""
+    header: str
+    first_car: str = ""
+    waiting_car: str = ""
+    # Короткие варианты для живой карточки: только номера, без счетчиков времени
+    first_car_short: str = ""
+    waiting_car_short: str = ""
+    live_footer: str = ""
+
+
+api_client = BorderApiClient(
+    connect_timeout=config.http_connect_timeout,
+    read_timeout=config.http_read_timeout,
+    retries=config.http_retries,
+    backoff_base=0.5,
+    backoff_max=8.0,
+    breaker=CircuitBreaker(config.circuit_failure_threshold, config.circuit_reset_timeout)
+)
+
+# Все исходящие уведомления идут через очередь с лимитами Telegram
+outbox = MessageDispatcher(
+    workers=config.outbox_workers,
+    max_queue_size=config.outbox_queue_size,
+    global_rate=config.outbox_global_rate,
+    chat_rate=config.outbox_chat_rate,
+    chat_burst=config.outbox_chat_burst
+)
+
+# Темп вызовов в ПП по пунктам пропуска - для оценки времени ожидания
+throughput = ThroughputEstimator()
+
+# История снимков для аналитики и разбора жалоб; пишется в фоне
+history = SnapshotHistory(
+    config.history_db_name,
+    retention_seconds=config.history_retention_days * 24 * 3600
+)
+
+
+async def fetch_queue_data(checkpoint: Checkpoint, conditional: bool = False) -> Optional[Dict]:
+    """Ответ API; при conditional=True может вернуть NOT_MODIFIED (см. BorderApiClient.get_json)."""
+    started = time.perf_counter()
+    result = "error"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(config.api_url) as response:
-                response.raise_for_status()
-                return await response.json()
-    except aiohttp.ClientError as e:
-        logger.error(f"API request error: {e}")
+        data = await api_client.get_json(checkpoint.api_url, conditional=conditional)
+        result = "not_modified" if data is NOT_MODIFIED else "ok"
+        return data
+    except CircuitOpenError:
+        result = "circuit_open"
+        logger.warning(f"API request for {checkpoint.name} skipped: circuit breaker is open")
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        logger.error(f"API request error for {checkpoint.name}: {e!r}")
         return None
+    finally:
+        API_REQUESTS.inc(checkpoint=checkpoint.name, result=result)
+        if result != "circuit_open":
+            API_LATENCY.observe(time.perf_counter() - started, checkpoint=checkpoint.name)
+
+
+class QueueSnapshot:
+    """
+    Один загруженный снимок очереди пункта пропуска, разобранный один раз в список QueueCar,
+    с индексом regnum -> машина, поэтому поиск машины в снимке занимает O(1).
+    Производные значения и общие части сообщений считаются лениво и живут вместе со снимком:
+    следующий снимок начинает с пустого кэша.
+    """
+    def __init__(self, checkpoint: Checkpoint, cars: List[QueueCar]):
+        self.checkpoint = checkpoint
+        self.cars = cars
+        self.index = {car.regnum: car for car in cars}
+        self.loaded_at = time.monotonic()
+        self.fetched_ts = int(time.time())
+        self._eta: Optional[EtaTable] = None
+        self._stats: Optional[QueueStats] = None
+        self._sections: Optional[SnapshotSections] = None
+        self._fingerprint: Optional[int] = None
+        self._summary: Optional[str] = None
+
+    @property
+    def age(self) -> float:
+        """Сколько секунд назад снимок был получен от API."""
+        return time.monotonic() - self.loaded_at
+
+    @property
+    def fingerprint(self) -> int:
+        """Отпечаток содержимого очереди: совпадает у снимков с одинаковыми машинами, статусами и временами."""
+        if self._fingerprint is None:
+            self._fingerprint = hash(tuple(
+                (car.regnum, car.order_id, car.status, car.registered_at, car.changed_at) for car in self.cars
+            ))
+        return self._fingerprint
+
+    def touch(self):
+        """
+        API подтвердил, что очередь не изменилась: данные снова свежие. Части, зависящие
+        от текущего времени (время ожидания, оценки, вызовы за последний час), пересчитываются.
+        """
+        self.loaded_at = time.monotonic()
+        self.fetched_ts = int(time.time())
+        self._sections = None
+        self._eta = None
+        self._summary = None
+
+    @property
+    def total_cars(self) -> int:
+        return len(self.cars)
+
+    @property
+    def checkpoint_label(self) -> Optional[str]:
+        """Название пункта пропуска для сообщений; при одном пункте его не показываем."""
+        return self.checkpoint.name if len(config.checkpoints) > 1 else None
+
+    @property
+    def stats(self) -> QueueStats:
+        """Первая машина, первая невызванная, количество по статусам - один проход на снимок."""
+        if self._stats is None:
+            self._stats = summarize_queue(self.cars)
+        return self._stats
 
-async def check_and_notify_user(bot: Bot, user_id: int, car_number: str, is_initial_check: bool = False):
-    api_data = await fetch_queue_data()
+    @property
+    def first_waiting_car(self) -> Optional[QueueCar]:
+        """Следующий на вызов; показываем, только если первая машина уже вызвана."""
+        first_car = self.stats.first_car
+        return self.stats.first_waiting_car if first_car and first_car.is_called else None
+
+    @property
+    def sections(self) -> SnapshotSections:
+        if self._sections is None:
+            # Время ожидания лидеров - на момент снимка, он один для всех сообщений
+            first_car, first_waiting_car = self.stats.first_car, self.first_waiting_car
+            self._sections = SnapshotSections(
+                header=format_queue_header(self.total_cars, self.checkpoint_label),
+                first_car=format_first_car(first_car, self.fetched_ts) if first_car else "",
+                waiting_car=format_waiting_car(first_waiting_car, self.fetched_ts) if first_waiting_car else "",
+                first_car_short=(
+                    f"\n🔝 **{'Вызван в ПП' if first_car.is_called else 'Первый в очереди'}:** `{first_car.regnum}`\n"
+                    if first_car else ""
+                ),
+                waiting_car_short=f"👑 **Следующий на вызов:** `{first_waiting_car.regnum}`\n" if first_waiting_car else "",
+                live_footer=f"\n📌 _Карточка обновляется автоматически. Данные на {format_queue_time(self.fetched_ts)}_"
+            )
+        return self._sections
+
+    @property
+    def eta(self) -> EtaTable:
+        """Оценки времени до вызова для этого снимка; считаются один раз и кэшируются."""
+        if self._eta is None:
+            self._eta = throughput.table(self.checkpoint.id, self.fetched_ts, self.stats.called_count)
+        return self._eta
+
+    @property
+    def summary(self) -> str:
+        """Сводка /queue без строки о свежести данных; считается один раз на снимок."""
+        if self._summary is None:
+            self._summary = format_queue_summary(
+                self.sections.header, self.stats, self.fetched_ts,
+                throughput.recent_calls(self.checkpoint.id, self.fetched_ts, QUEUE_SUMMARY_WINDOW)
+            )
+        return self._summary
+
+    def reset_eta(self):
+        """Сбрасывает оценки, посчитанные до того, как вызовы из этого снимка попали в статистику."""
+        self._eta = None
+        self._summary = None
+
+    def find(self, car_number: str) -> Optional[QueueCar]:
+        return self.index.get(car_number)
+
+    def live_card(self, user_car: QueueCar, eta_seconds: Optional[float] = None) -> Tuple[str, str]:
+        """
+        Текст живой карточки и хеш ее содержимого. Хеш считается без подписи с временем данных
+        и без счетчиков, которые растут сами по себе, поэтому меняется только вместе с очередью.
+        """
+        sections = self.sections
+        status_text = STATUS_MAP.get(user_car.status, "Неизвестный статус")
+        body = sections.header + (
+            f"🚙 **Ваш авто:** `{user_car.regnum}`\n"
+            f"🚦 **Статус:** *{status_text}*\n"
+        )
+        if not user_car.is_called:
+            body += f"📍 **Позиция в очереди:** `{user_car.order_id}`\n"
+            if eta_seconds is not None:
+                body += f"🕐 **Ожидаемый вызов:** `около {format_eta_clock(self.fetched_ts + eta_seconds)}`\n"
+        if user_car.registered_at is not None:
+            body += f"📅 **Зарегистрирован:** `{format_queue_time(user_car.registered_at)}`\n"
+
+        stats = self.stats
+        if stats.first_car is not None and stats.first_car.regnum != user_car.regnum:
+            body += sections.first_car_short
+        first_waiting_car = self.first_waiting_car
+        if first_waiting_car is not None and first_waiting_car.regnum != user_car.regnum:
+            body += sections.waiting_car_short
+
+        card_hash = hashlib.blake2b(body.encode(), digest_size=8).hexdigest()
+        return body + sections.live_footer, card_hash
+
+    def format_car_info(self, user_car: QueueCar, eta_seconds: Optional[float] = None, full: bool = True) -> str:
+        """
+        Карточка машины из этого снимка: рендерится только личная часть, остальное берется из кэша.
+        full=False - без блоков о первых машинах и возрасте данных.
+        """
+        sections = self.sections
+        info_text = sections.header + format_user_car(user_car, int(time.time()), eta_seconds)
+        if not full:
+            return info_text
+        stats = self.stats
+        if stats.first_car is not None and stats.first_car.regnum != user_car.regnum:
+            info_text += sections.first_car
+        first_waiting_car = self.first_waiting_car
+        if first_waiting_car is not None and first_waiting_car.regnum != user_car.regnum:
+            info_text += sections.waiting_car
+        return info_text + f"\n🕒 _Данные обновлены {format_data_age(self.age)}_\n"
+
+
+async def fetch_snapshot(checkpoint: Checkpoint) -> Optional[QueueSnapshot]:
+    """
+    Новый снимок очереди. Если очередь с прошлой загрузки не изменилась (304, то же тело
+    ответа или те же машины), возвращается прежний объект снимка с обновленным временем
+    загрузки: планировщик узнает его по идентичности и пропускает всю обработку.
+    """
+    previous = queue_caches[checkpoint.id].peek()
+    api_data = await fetch_queue_data(checkpoint, conditional=previous is not None)
+    if api_data is NOT_MODIFIED:
+        previous.touch()
+        return previous
     if not api_data or "carLiveQueue" not in api_data:
-        logger.warning("Could not fetch or parse API data.")
-        return
+        logger.warning(f"Could not fetch or parse API data for {checkpoint.name}.")
+        return None
+    snapshot = QueueSnapshot(checkpoint, decode_queue(api_data["carLiveQueue"]))
+    # Только разобранный без ошибок ответ становится базой для следующих условных запросов:
+    # повторяющийся ошибочный ответ не должен превращаться в NOT_MODIFIED и "свежий" старый снимок
+    api_client.accept(checkpoint.api_url)
+    if previous is not None and snapshot.fingerprint == previous.fingerprint:
+        previous.touch()
+        return previous
+    return snapshot
+
+
+# Свой кэш на каждый пункт пропуска, HTTP-пул и очередь сообщений общие
+queue_caches: Dict[str, SnapshotCache[QueueSnapshot]] = {
+    checkpoint.id: SnapshotCache(
+        lambda checkpoint=checkpoint: fetch_snapshot(checkpoint),
+        ttl=config.snapshot_ttl,
+        stale_ttl=config.snapshot_stale_ttl,
+        refresh_timeout=config.snapshot_refresh_timeout
+    )
+    for checkpoint in config.checkpoints
+}
+
+# Значения, которые считаются в момент снятия метрик
+registry.gauge(
+    "snapshot_age_seconds", "Age of the last successful queue snapshot", ("checkpoint",),
+    callback=lambda: [
+        ((checkpoint.name,), queue_caches[checkpoint.id].age)
+        for checkpoint in config.checkpoints if queue_caches[checkpoint.id].age is not None
+    ]
+)
+registry.gauge("outbox_pending_messages", "Messages waiting in the outbox", callback=lambda: [((), outbox.pending)])
+
+
+def format_queue_overview() -> str:
+    """
+    Ответ на /queue по последним снимкам всех пунктов пропуска. Снимки берутся из кэша
+    без обновления: их держит свежими планировщик, так что ответ не стоит ни API, ни БД.
+    """
+    parts = []
+    for checkpoint in config.checkpoints:
+        snapshot = queue_caches[checkpoint.id].peek()
+        if snapshot is None:
+            name = f" ({checkpoint.name})" if len(config.checkpoints) > 1 else ""
+            parts.append(f"⚠️ Данные об очереди{name} еще не загружены. Попробуйте чуть позже.\n")
+        else:
+            parts.append(snapshot.summary + f"\n🕒 _Данные обновлены {format_data_age(snapshot.age)}_\n")
+    return "📊 **Состояние очереди**\n\n" + "\n".join(parts)
+
+
+def observe_calls(snapshot: QueueSnapshot, previous: Optional[QueueSnapshot]):
+    """
+    Учитывает в throughput вызовы, появившиеся в snapshot по сравнению с previous.
+    Нужно процессам, которые получают снимки, но не обрабатывают их через process_snapshot.
+    """
+    previous_index = previous.index if previous is not None else {}
+    called_at = []
+    for car in snapshot.cars:
+        if car.is_called:
+            old = previous_index.get(car.regnum)
+            if old is None or not old.is_called:
+                called_at.append(car.changed_at)
+    throughput.observe(snapshot.checkpoint.id, snapshot.fetched_ts, called_at)
+
+
+async def get_queue_snapshot(
+    checkpoint_id: str,
+    allow_stale: bool = True,
+    max_age: Optional[float] = None
+) -> Optional[QueueSnapshot]:
+    """
+    Снимок очереди пункта пропуска через общий кэш: свежий снимок переиспользуется,
+    одновременные запросы объединяются в один вызов API.
+    """
+    cache = queue_caches.get(checkpoint_id)
+    if cache is None:
+        logger.warning(f"Unknown checkpoint {checkpoint_id}")
+        return None
+    return await cache.get(allow_stale=allow_stale, max_age=max_age)
+
+
+class CarUpdates:
+    """
+    Изменения состояния машин, накопленные за тик.
+    Применяются к БД одной транзакцией вместо отдельного commit на каждую машину.
+    """
+    def __init__(self, checkpoint_id: str):
+        self.checkpoint_id = checkpoint_id
+        self.state_updates: List[Tuple[Optional[int], int, str, str]] = []
+        self.status_updates: List[Tuple[int, str, str]] = []
+        self.removals: List[Tuple[str, str]] = []
+
+    def update_state(self, car_number: str, pos: Optional[int], status: int):
+        self.state_updates.append((pos, status, self.checkpoint_id, car_number))
+
+    def update_status_only(self, car_number: str, status: int):
+        self.status_updates.append((status, self.checkpoint_id, car_number))
+
+    def remove(self, car_number: str):
+        self.removals.append((self.checkpoint_id, car_number))
+
+    async def apply(self):
+        await db.apply_car_updates(self.state_updates, self.status_updates, self.removals)
+
+
+@dataclass
+class FleetStatus:
+    """
+    Машины пользователя, сопоставленные со снимками очередей за один проход.
+    found отсортированы по пункту пропуска и позиции; missing - пропали из очереди,
+    unavailable - по их пункту пропуска сейчас нет данных. Оба списка: (checkpoint_id, regnum).
+    """
+    found: List[Tuple[QueueSnapshot, QueueCar]] = field(default_factory=list)
+    missing: List[Tuple[str, str]] = field(default_factory=list)
+    unavailable: List[Tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def pages(self) -> int:
+        return max(1, -(-len(self.found) // FLEET_PAGE_SIZE))
+
+    def page_entries(self, page: int) -> List[Tuple[QueueSnapshot, QueueCar]]:
+        return self.found[page * FLEET_PAGE_SIZE:(page + 1) * FLEET_PAGE_SIZE]
+
+
+async def resolve_user_cars(cars: List[Tuple[str, str]]) -> FleetStatus:
+    """
+    Находит все машины пользователя в снимках: каждый нужный снимок загружается один раз
+    (параллельно), дальше только поиск по индексу.
+    """
+    checkpoint_ids = list(dict.fromkeys(checkpoint_id for checkpoint_id, _ in cars))
+    snapshots = dict(zip(checkpoint_ids, await asyncio.gather(*(get_queue_snapshot(cp_id) for cp_id in checkpoint_ids))))
+
+    status = FleetStatus()
+    for checkpoint_id, car_number in cars:
+        snapshot = snapshots[checkpoint_id]
+        if snapshot is None:
+            status.unavailable.append((checkpoint_id, car_number))
+            continue
+        car = snapshot.find(car_number)
+        if car is None:
+            status.missing.append((checkpoint_id, car_number))
+        else:
+            status.found.append((snapshot, car))
+
+    order = {checkpoint_id: i for i, checkpoint_id in enumerate(checkpoint_ids)}
+    status.found.sort(key=lambda item: (
+        order[item[0].checkpoint.id], item[1].order_id if item[1].order_id is not None else float("inf")
+    ))
+    return status
+
+
+def format_fleet_page(status: FleetStatus, page: int, removed: Optional[List[Tuple[str, str]]] = None) -> str:
+    """Сводка по автопарку: одна страница таблицы номер / позиция / статус / ожидание."""
+    entries = status.page_entries(page)
+    total = len(status.found) + len(status.unavailable)
+    now = int(time.time())
+
+    info_text = f"🚚 **Ваши авто: {total}**"
+    if status.pages > 1:
+        info_text += f" (стр. {page + 1}/{status.pages})"
+    info_text += "\n"
+
+    current_checkpoint = None
+    table = []
+    for snapshot, car in entries:
+        if snapshot.checkpoint_label and snapshot.checkpoint is not current_checkpoint:
+            if table:
+                info_text += "```\n" + "\n".join(table) + "\n```"
+                table = []
+            current_checkpoint = snapshot.checkpoint
+            info_text += f"\n🛂 **{snapshot.checkpoint_label}**\n"
+        if not table:
+            table.append(f"{'Номер':<10} {'Поз.':>5} {'Статус':<7} Ждет")
+        position = "-" if car.is_called or car.order_id is None else str(car.order_id)
+        wait = (car.changed_at if car.is_called else now) - car.registered_at
+        table.append(f"{car.regnum:<10} {position:>5} {STATUS_SHORT.get(car.status, '?'):<7} {format_wait_short(wait)}")
+    if table:
+        info_text += "```\n" + "\n".join(table) + "\n```"
+
+    if status.unavailable:
+        numbers = ", ".join(f"`{car_number}`" for _, car_number in status.unavailable)
+        info_text += f"\n⚠️ Нет данных об очереди для: {numbers}. Попробуйте позже.\n"
+    if removed:
+        numbers = ", ".join(f"`{car_number}`" for _, car_number in removed)
+        info_text += f"\nℹ️ Не найдены в очереди и удалены из списка: {numbers}\n"
+    if entries:
+        data_age = max(snapshot.age for snapshot, _ in entries)
+        info_text += f"\n🕒 _Данные обновлены {format_data_age(data_age)}_\n"
+    return info_text
+
+
+async def start_tracking(
+    user_id: int,
+    checkpoint_id: str,
+    car_numbers: List[str]
+) -> Tuple[List[str], List[str], List[str], List[str]]:
+    """
+    Массовое добавление машин: одна транзакция на добавление и одна на начальное состояние.
+    Возвращает (найдены в очереди, не найдены и не добавлены, уже отслеживались, не проверены).
+    Если снимка нет, добавленные машины остаются непроверенными: планировщик сверит их с очередью
+    при следующем изменении данных и удалит ненайденные с уведомлением.
+    """
+    added = await db.add_cars(user_id, checkpoint_id, car_numbers)
+    added_set = set(added)
+    duplicates = [car_number for car_number in car_numbers if car_number not in added_set]
+
+    snapshot = await get_queue_snapshot(checkpoint_id)
+    if snapshot is None:
+        return [], [], duplicates, added
+
+    found, missing = [], []
+    updates = CarUpdates(checkpoint_id)
+    for car_number in added:
+        car = snapshot.find(car_number)
+        if car is None:
+            missing.append(car_number)
+            updates.remove(car_number)
+        else:
+            found.append(car_number)
+            updates.update_state(car_number, car.order_id, car.status)
+    await updates.apply()
+    return found, missing, duplicates, []
+
+
+async def check_and_notify_user(
+    user_id: int,
+    checkpoint_id: str,
+    car_number: str,
+    is_initial_check: bool = False,
+    snapshot: Optional[QueueSnapshot] = None,
+    last_state: Optional[Dict] = None,
+    updates: Optional[CarUpdates] = None
+):
+    """
+    Проверяет одну машину по снимку очереди и отправляет уведомления.
+    Если передан updates, изменения в БД только накапливаются в нем и применяются вызывающим.
+    """
+    # Планировщик передает уже загруженный снимок, чтобы не скачивать очередь для каждой машины
+    if snapshot is None:
+        snapshot = await get_queue_snapshot(checkpoint_id)
+        if snapshot is None:
+            return
+
+    batch = updates if updates is not None else CarUpdates(checkpoint_id)
+    try:
+        await _evaluate_car(user_id, car_number, is_initial_check, snapshot, last_state, batch)
+    finally:
+        if updates is None:
+            await batch.apply()
+
+
+async def _evaluate_car(
+    user_id: int,
+    car_number: str,
+    is_initial_check: bool,
+    snapshot: QueueSnapshot,
+    last_state: Optional[Dict],
+    updates: CarUpdates
+):
+    user_car = snapshot.find(car_number)
+    # Добавлена, когда снимка не было: для пользователя это и есть первая проверка
+    never_checked = last_state is not None and last_state.get("last_status") is None
 
-    queue = api_data["carLiveQueue"]
-    total_cars = len(queue)
-    user_car = next((car for car in queue if car["regnum"] == car_number), None)
-    
     if not user_car:
-        if is_initial_check:
-            await bot.send_message(user_id, f"❌ Не удалось найти автомобиль с номером `{car_number}` в очереди.")
-        await db.remove_car(car_number)
-        await bot.send_message(user_id, f"ℹ️ Автомобиль `{car_number}` больше не отслеживается (пропал из списка очереди).")
+        if is_initial_check or never_checked:
+            await outbox.send(user_id, f"❌ Не удалось найти автомобиль с номером `{car_number}` в очереди.")
+        updates.remove(car_number)
+        await outbox.send(user_id, f"ℹ️ Автомобиль `{car_number}` больше не отслеживается (пропал из списка очереди).", Priority.LOW)
         return
 
-    first_car_overall = queue[0] if queue else None
-    first_waiting_car = None
-    if first_car_overall and first_car_overall.get('status') == 3:
-        first_waiting_car = next((car for car in queue if car.get("status") != 3), None)
-
-    current_pos = user_car.get("order_id")
-    current_status = user_car["status"]
+    current_pos = user_car.order_id
+    current_status = user_car.status
+    current_eta = snapshot.eta.eta_seconds(current_pos)
 
     if is_initial_check:
-        message_text = format_car_info(user_car, total_cars, first_car_overall, first_waiting_car)
-        await bot.send_message(user_id, message_text)
+        if config.live_cards:
+            # Первая карточка и становится живой: дальше она правится, а не отправляется заново
+            card_text, card_hash = snapshot.live_card(user_car, current_eta)
+            _track_card_delivery(snapshot.checkpoint.id, car_number, await outbox.send(user_id, card_text), card_hash)
+        else:
+            message_text = snapshot.format_car_info(user_car, current_eta)
+            await outbox.send(user_id, message_text)
         # Сохраняем и позицию для уведомлений, и статус
-        await db.update_car_state(car_number, current_pos, current_status)
+        updates.update_state(car_number, current_pos, current_status)
         return
 
-    last_state = await db.get_car_state(car_number)
+    if last_state is None:
+        last_state = await db.get_car_state(snapshot.checkpoint.id, car_number)
     if not last_state: return
 
     notified_pos = last_state.get("notified_pos")
     last_status = last_state.get("last_status")
+
+    if last_status is None and current_status != STATUS_CALLED:
+        # Первая сверка с очередью: запоминаем начальное состояние, уведомлять пока не о чем
+        updates.update_state(car_number, current_pos, current_status)
+        if config.live_cards:
+            await _refresh_live_card(user_id, car_number, snapshot, user_car, current_eta, last_state)
+        return
     
     notification_text = ""
     should_send_notification = False
 
     # 1. Проверка на вызов в ПП (высший приоритет)
-    if current_status == 3 and last_status != 3:
-        message_on_call = format_car_info(user_car, total_cars)
+    if current_status == STATUS_CALLED and last_status != STATUS_CALLED:
+        message_on_call = snapshot.format_car_info(user_car, full=False)
         full_message = f"🚨 **ВНИМАНИЕ! ВЫЗВАН В ПП!** 🚨\n\n{message_on_call}"
         for _ in range(3):
-            await bot.send_message(user_id, full_message)
-        await db.remove_car(car_number)
+            await outbox.send(user_id, full_message, Priority.URGENT)
+        updates.remove(car_number)
         return
 
     # 2. Проверка на продвижение в очереди
@@ -177,19 +760,259 @@ async def check_and_notify_user(bot: Bot, user_id: int, car_number: str, is_init
             should_send_notification = True
             notification_text = f"🔔 Очередь продвинулась! Ваша позиция: **{current_pos}**."
 
+        # 3. Пороги по времени: с тем же темпом сравниваем ожидание на прошлой и текущей позиции
+        notified_eta = snapshot.eta.eta_seconds(notified_pos)
+        if current_eta is not None and notified_eta is not None:
+            for minutes in ETA_THRESHOLDS_MINUTES:
+                if notified_eta > minutes * 60 >= current_eta:
+                    should_send_notification = True
+                    notification_text = (
+                        f"⏰ До вызова осталось около {minutes} мин. Ваша позиция: **{current_pos}**."
+                    )
+                    break
+
     if should_send_notification:
-        full_message = f"{notification_text}\n\n{format_car_info(user_car, total_cars, first_car_overall, first_waiting_car)}"
-        await bot.send_message(user_id, full_message)
+        if config.live_cards:
+            # Уведомление короткое, подробности - в живой карточке
+            await outbox.send(user_id, notification_text)
+        else:
+            car_info = snapshot.format_car_info(user_car, current_eta)
+            full_message = f"{notification_text}\n\n{car_info}"
+            await outbox.send(user_id, full_message)
         # Обновляем и позицию, и статус
-        await db.update_car_state(car_number, current_pos, current_status)
+        updates.update_state(car_number, current_pos, current_status)
     else:
         # Если уведомление не отправлено, обновляем ТОЛЬКО статус
         if current_status != last_status:
-            await db.update_car_status_only(car_number, current_status)
+            updates.update_status_only(car_number, current_status)
+
+    if config.live_cards:
+        await _refresh_live_card(user_id, car_number, snapshot, user_car, current_eta, last_state)
+
+
+# Живые карточки, доставка которых еще не подтверждена: (checkpoint_id, regnum)
+_pending_cards: Set[Tuple[str, str]] = set()
+_card_tasks: Set[asyncio.Task] = set()
+
+
+async def _refresh_live_card(
+    user_id: int,
+    car_number: str,
+    snapshot: QueueSnapshot,
+    user_car: QueueCar,
+    eta_seconds: Optional[float],
+    last_state: Dict
+):
+    """Правит живую карточку машины, только если ее содержимое изменилось; если карточки нет - отправляет новую."""
+    if (snapshot.checkpoint.id, car_number) in _pending_cards:
+        return
+    card_text, card_hash = snapshot.live_card(user_car, eta_seconds)
+    if card_hash == last_state.get("card_hash"):
+        return
+
+    message_id = last_state.get("card_message_id")
+    if message_id is None:
+        future = await outbox.send(user_id, card_text, Priority.LOW)
+        _track_card_delivery(snapshot.checkpoint.id, car_number, future, card_hash)
+    else:
+        future = await outbox.edit(user_id, message_id, card_text)
+        _track_card_delivery(snapshot.checkpoint.id, car_number, future, card_hash, message_id)
+
+
+def _track_card_delivery(
+    checkpoint_id: str,
+    car_number: str,
+    future: asyncio.Future,
+    card_hash: str,
+    message_id: Optional[int] = None
+):
+    """
+    Дожидается доставки карточки в фоне, не задерживая тик. id сообщения и хеш карточки
+    пишутся в БД только здесь, после ответа Telegram, чтобы запись из тика не перетерла результат.
+    Новая карточка (message_id не задан) - запоминаем id ее сообщения.
+    Неудачная правка (сообщение удалено или слишком старое) - забываем карточку,
+    и следующее изменение придет новым сообщением.
+    """
+    key = (checkpoint_id, car_number)
+    _pending_cards.add(key)
+
+    async def wait_delivery():
+        try:
+            result = await future
+            if result:
+                await db.set_car_card(checkpoint_id, car_number, result if message_id is None else message_id, card_hash)
+            elif message_id is not None:
+                await db.set_car_card(checkpoint_id, car_number, None, None)
+        finally:
+            _pending_cards.discard(key)
+
+    task = asyncio.create_task(wait_delivery())
+    _card_tasks.add(task)
+    task.add_done_callback(_card_tasks.discard)
+
+
+@dataclass(frozen=True)
+class UserShard:
+    """Доля пользователей процесса-рассыльщика в многопроцессном режиме: user_id % count == index."""
+    index: int
+    count: int
+
+    def owns(self, user_id: int) -> bool:
+        return user_id % self.count == self.index
+
 
+# Снимки, обработанные предыдущим тиком (по пунктам пропуска): с ними сравниваются новые
+_last_processed_snapshots: Dict[str, QueueSnapshot] = {}
+# Отчеты последних обработанных снимков: пока очередь не меняется, тик отдает их без запросов к БД
+_last_reports: Dict[str, TickReport] = {}
+# Каких пользователей проверяет process_snapshot в этом процессе (см. cluster.py).
+# По умолчанию - всех; загрузчик очереди не проверяет никого.
+_notify_users = True
+_user_shard: Optional[UserShard] = None
+# Ограничивает число одновременно опрашиваемых пунктов пропуска
+_poll_semaphore = asyncio.Semaphore(config.max_parallel_polls)
 
-async def scheduled_job(bot: Bot):
+
+def set_user_shard(shard: Optional[UserShard], notify_users: bool = True):
+    """Задает, каких пользователей проверяет этот процесс; вызывается при запуске роли в cluster.py."""
+    global _notify_users, _user_shard
+    _notify_users = notify_users
+    _user_shard = shard
+
+
+async def scheduled_job() -> List[TickReport]:
+    """
+    Один тик планировщика по всем пунктам пропуска.
+    Возвращает отчеты по пунктам, которые удалось проверить; по ним подбирается следующий интервал.
+    """
     logger.info("Scheduler running a check...")
-    all_tracked_cars = await db.get_all_tracked_cars()
-    for user_id, car_number in all_tracked_cars:
-        await check_and_notify_user(bot, user_id, car_number)
\ No newline at end of file
+    with TICK_LATENCY.time():
+        results = await asyncio.gather(
+            *(_check_checkpoint(checkpoint) for checkpoint in config.checkpoints),
+            return_exceptions=True
+        )
+    reports = []
+    for checkpoint, result in zip(config.checkpoints, results):
+        if isinstance(result, Exception):
+            logger.error(f"Check for {checkpoint.name} failed: {result!r}")
+        elif result is not None:
+            reports.append(result)
+    if not reports:
+        TICKS.inc(result="failed")
+    elif any(report.changed for report in reports):
+        TICKS.inc(result="ok")
+    else:
+        TICKS.inc(result="skipped")
+    return reports
+
+
+async def _check_checkpoint(checkpoint: Checkpoint) -> Optional[TickReport]:
+    timer = PhaseTimer(checkpoint.name)
+    try:
+        async with _poll_semaphore:
+            # Одна загрузка очереди на весь тик, общая для всех отслеживаемых машин.
+            # Устаревший снимок планировщику не нужен: его уже обработал предыдущий тик.
+            snapshot = await get_queue_snapshot(checkpoint.id, allow_stale=False, max_age=config.poll_min_interval / 2)
+        timer.mark("fetch")
+        if snapshot is None:
+            CHECKS.inc(checkpoint=checkpoint.name, result="failed")
+            return None
+        return await process_snapshot(checkpoint, snapshot, timer)
+    finally:
+        timer.finish(config.slow_tick_seconds)
+
+
+async def process_snapshot(checkpoint: Checkpoint, snapshot: QueueSnapshot, timer: PhaseTimer) -> TickReport:
+    """
+    Сравнивает снимок с предыдущим обработанным, пишет историю и проверяет изменившиеся
+    машины тех пользователей, которых обслуживает этот процесс (см. set_user_shard).
+    """
+    QUEUE_LENGTH.set(snapshot.total_cars, checkpoint=checkpoint.name)
+    previous = _last_processed_snapshots.get(checkpoint.id)
+    if snapshot is previous and checkpoint.id in _last_reports:
+        # Очередь не изменилась: ни сравнения, ни оценок, ни сообщений, ни запросов к БД.
+        # Машины, добавленные с тех пор, попадут в ближайшую позицию на следующем изменении очереди.
+        CHECKS.inc(checkpoint=checkpoint.name, result="skipped")
+        return TickReport(changed=False, closest_position=_last_reports[checkpoint.id].closest_position)
+
+    cars_per_minute = 0.0
+    if previous is None:
+        # Первый тик: сравнивать не с чем, проверяем все машины
+        history.record(checkpoint.id, snapshot.index, None)
+        throughput.observe(
+            checkpoint.id, snapshot.fetched_ts,
+            (car.changed_at for car in snapshot.cars if car.is_called)
+        )
+        timer.mark("diff")
+        tracked_cars = await db.get_all_tracked_cars_state(checkpoint.id) if _notify_users else []
+        timer.mark("db_read")
+        changed = True
+    else:
+        # Дальше проверяем только машины, которые изменились между снимками
+        diff = diff_snapshots(previous.index, snapshot.index)
+        logger.info(
+            f"Queue diff for {checkpoint.name}: +{len(diff.appeared)} -{len(diff.disappeared)} "
+            f"status:{len(diff.status_changed)} order:{len(diff.order_changed)}"
+        )
+        history.record(checkpoint.id, snapshot.index, diff)
+        newly_called = [regnum for regnum, (_, new_status) in diff.status_changed.items() if new_status == STATUS_CALLED]
+        newly_called += [regnum for regnum in diff.appeared if snapshot.index[regnum].is_called]
+        throughput.observe(checkpoint.id, snapshot.fetched_ts, (snapshot.index[regnum].changed_at for regnum in newly_called))
+        timer.mark("diff")
+        tracked_cars = await db.get_tracked_cars_state(checkpoint.id, diff.changed) if _notify_users and not diff.is_empty else []
+        if _notify_users:
+            # Машины, добавленные без снимка, в diff могут и не попасть: их проверяем, пока они не сверены с очередью
+            changed_numbers = {row[1] for row in tracked_cars}
+            tracked_cars += [
+                row for row in await db.get_unchecked_cars_state(checkpoint.id) if row[1] not in changed_numbers
+            ]
+        timer.mark("db_read")
+        changed = not diff.is_empty
+        # Скорость очереди: сколько машин вызвано или ушло из очереди между снимками
+        moved = len(diff.disappeared) + sum(1 for _, new_status in diff.status_changed.values() if new_status == STATUS_CALLED)
+        elapsed = snapshot.loaded_at - previous.loaded_at
+        if elapsed > 0:
+            cars_per_minute = moved / elapsed * 60
+
+    if _user_shard is not None:
+        tracked_cars = [row for row in tracked_cars if _user_shard.owns(row[0])]
+
+    # ETA для всех проверяемых машин одним проходом; дальше оценки берутся из кэша снимка
+    snapshot.reset_eta()
+    positions = []
+    for _, car_number, notified_pos, *_ in tracked_cars:
+        car = snapshot.index.get(car_number)
+        positions.append(car.order_id if car else None)
+        positions.append(notified_pos)
+    snapshot.eta.eta_many(positions)
+    timer.mark("eta")
+
+    updates = CarUpdates(checkpoint.id)
+    try:
+        for user_id, car_number, notified_pos, last_status, card_message_id, card_hash in tracked_cars:
+            last_state = {
+                "notified_pos": notified_pos,
+                "last_status": last_status,
+                "card_message_id": card_message_id,
+                "card_hash": card_hash
+            }
+            await check_and_notify_user(
+                user_id, checkpoint.id, car_number, snapshot=snapshot, last_state=last_state, updates=updates
+            )
+        timer.mark("evaluate")
+    finally:
+        # Все обновления и удаления за тик - одной транзакцией
+        await updates.apply()
+        timer.mark("apply")
+    _last_processed_snapshots[checkpoint.id] = snapshot
+
+    TRACKED_CARS.set(await db.count_tracked_cars(checkpoint.id), checkpoint=checkpoint.name)
+    report = TickReport(
+        changed=changed,
+        closest_position=await db.get_closest_tracked_position(checkpoint.id),
+        cars_per_minute=cars_per_minute
+    )
+    _last_reports[checkpoint.id] = report
+    CHECKS.inc(checkpoint=checkpoint.name, result="processed")
+    timer.mark("report")
+    return report
@@ -0,0 +1,93 @@
+# snapshot_cache.py
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SnapshotCache(Generic[T]):
+    """
+    Кэш последнего снимка очереди перед загрузчиком.
+
+    - Свежий снимок (моложе ttl) отдается без запроса к API.
+    - Одновременные вызовы ждут один и тот же запрос (single-flight).
+    - Если API медленный или недоступен, отдается последний удачный снимок,
+      пока он не старше stale_ttl (stale-while-revalidate).
+    """
+    def __init__(
+        self,
+        loader: Callable[[], Awaitable[Optional[T]]],
+        ttl: float,
+        stale_ttl: float,
+        refresh_timeout: float
+    ):
+        self._loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.refresh_timeout = refresh_timeout
+        self._value: Optional[T] = None
+        self._loaded_at: Optional[float] = None
+        self._inflight: Optional[asyncio.Task] = None
+
+    @property
+    def age(self) -> Optional[float]:
+        """Возраст последнего удачного снимка в секундах (None, если снимков еще не было)."""
+        if self._loaded_at is None:
+            return None
+        return time.monotonic() - self._loaded_at
+
+    def peek(self) -> Optional[T]:
+        """Последний удачный снимок без обращения к API."""
+        return self._value
+
+    def put(self, value: T):
+        """Кладет снимок, полученный в обход загрузчика (например, от процесса-загрузчика очереди)."""
+        self._value = value
+        self._loaded_at = time.monotonic()
+
+    async def get(self, allow_stale: bool = True, max_age: Optional[float] = None) -> Optional[T]:
+        """
+        max_age позволяет вызывающему требовать снимок свежее, чем ttl
+        (например, планировщику, который опрашивает чаще ttl).
+        """
+        age = self.age
+        fresh_for = self.ttl if max_age is None else min(self.ttl, max_age)
+        if self._value is not None and age is not None and age < fresh_for:
+            return self._value
+
+        task = self._inflight
+        if task is None:
+            task = self._inflight = asyncio.create_task(self._refresh())
+
+        has_fallback = allow_stale and self._value is not None and age is not None and age < self.stale_ttl
+        try:
+            if has_fallback:
+                # Не ждем медленный API дольше refresh_timeout: запрос продолжится в фоне
+                value = await asyncio.wait_for(asyncio.shield(task), self.refresh_timeout)
+            else:
+                value = await asyncio.shield(task)
+        except asyncio.TimeoutError:
+            logger.warning(f"Snapshot refresh is slow, serving a stale snapshot ({age:.0f}s old)")
+            return self._value
+
+        if value is None and has_fallback:
+            logger.warning(f"Snapshot refresh failed, serving a stale snapshot ({age:.0f}s old)")
+            return self._value
+        return value
+
+    async def _refresh(self) -> Optional[T]:
+        try:
+            value = await self._loader()
+            if value is not None:
+                self._value = value
+                self._loaded_at = time.monotonic()
+            return value
+        except Exception as e:
+            logger.error(f"Snapshot loader failed: {e}")
+            return None
+        finally:
+            self._inflight = None
@@ -0,0 +1,51 @@
+# snapshot_diff.py
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set, Tuple
+
+from queue_model import QueueCar
+
+
+@dataclass
+class SnapshotDiff:
+    """
+    Разница между двумя последовательными снимками очереди.
+    order_changed: regnum -> (старая позиция, новая позиция, на сколько продвинулась).
+    """
+    appeared: Set[str] = field(default_factory=set)
+    disappeared: Set[str] = field(default_factory=set)
+    status_changed: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+    order_changed: Dict[str, Tuple[Optional[int], Optional[int], int]] = field(default_factory=dict)
+
+    @property
+    def changed(self) -> Set[str]:
+        """Все номера, по которым что-то изменилось."""
+        return self.appeared | self.disappeared | self.status_changed.keys() | self.order_changed.keys()
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.appeared or self.disappeared or self.status_changed or self.order_changed)
+
+
+def diff_snapshots(previous: Optional[Dict[str, QueueCar]], current: Dict[str, QueueCar]) -> SnapshotDiff:
+    """
+    Сравнивает индексы regnum -> машина двух снимков.
+    Без предыдущего снимка все машины считаются появившимися.
+    """
+    if previous is None:
+        return SnapshotDiff(appeared=set(current))
+
+    diff = SnapshotDiff(
+        appeared=current.keys() - previous.keys(),
+        disappeared=previous.keys() - current.keys()
+    )
+    for regnum, car in current.items():
+        old_car = previous.get(regnum)
+        if old_car is None:
+            continue
+        if old_car.status != car.status:
+            diff.status_changed[regnum] = (old_car.status, car.status)
+        old_pos, new_pos = old_car.order_id, car.order_id
+        if old_pos != new_pos:
+            moved = old_pos - new_pos if old_pos is not None and new_pos is not None else 0
+            diff.order_changed[regnum] = (old_pos, new_pos, moved)
+    return diff
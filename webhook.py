@@ -0,0 +1,159 @@
+# webhook.py
+import asyncio
+import hmac
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from metrics import WEBHOOK_UPDATE_LATENCY, WEBHOOK_UPDATES, registry
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_sender(update: Dict[str, Any]) -> Optional[int]:
+    """id пользователя (или чата), от которого пришло обновление; None для обновлений без отправителя."""
+    for value in update.values():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("chat")
+            if isinstance(sender, dict):
+                return sender.get("id")
+    return None
+
+
+class WebhookServer:
+    """
+    Прием обновлений Telegram по webhook в том же процессе, что и бот.
+
+    Запрос проверяется по секретному токену, обновление кладется в очередь своего отправителя,
+    и Telegram сразу получает 200. Обрабатывают очереди workers задач через dp.feed_raw_update,
+    поэтому медленный обработчик не задерживает прием. Воркер берет только отправителя, чье
+    предыдущее обновление уже обработано: порядок внутри одного пользователя сохраняется
+    (от этого зависят шаги FSM), а его медленное обновление не занимает остальных воркеров.
+    Если ожидающих обновлений больше queue_size, отвечаем 503: Telegram повторит доставку позже,
+    а не потеряет обновление.
+
+    Рассчитан на одну реплику: у каждого процесса свой планировщик опросов, хранилище FSM
+    и кэш авторизации, поэтому несколько реплик за балансировщиком дублировали бы уведомления
+    и теряли шаги диалога.
+    """
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        path: str,
+        secret: str,
+        workers: int,
+        queue_size: int
+    ):
+        if not secret:
+            raise ValueError("Webhook secret token is required")
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.queue_size = queue_size
+        # Очереди обновлений по отправителям; отправитель есть здесь, пока у него что-то ждет или обрабатывается
+        self._senders: Dict[Hashable, Deque[Dict[str, Any]]] = {}
+        # Отправители, у которых есть обновления и которых сейчас никто не обрабатывает
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._pending = 0
+        self._tasks: List[asyncio.Task] = []
+        self._runner: Optional[web.AppRunner] = None
+        registry.gauge("webhook_pending_updates", "Updates waiting for a webhook worker", callback=lambda: [((), self._pending)])
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        # Проверка живости для супервизора или балансировщика перед единственной репликой
+        app.router.add_get("/healthz", self.health)
+        return app
+
+    async def start(self, host: str, port: int):
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"webhook-worker-{i}"))
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Webhook endpoint listening on http://{host}:{port}{self.path}")
+
+    async def join(self):
+        """Ждет, пока все принятые обновления будут обработаны."""
+        await self._ready.join()
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Перестает принимать запросы, дает воркерам разобрать очередь и останавливает их."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        try:
+            await asyncio.wait_for(self.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Webhook stopped with {self._pending} unprocessed updates")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            WEBHOOK_UPDATES.inc(result="unauthorized")
+            return web.Response(status=401)
+        try:
+            update = await request.json(loads=json.loads)
+        except ValueError:
+            WEBHOOK_UPDATES.inc(result="bad_request")
+            return web.Response(status=400)
+        if not isinstance(update, dict) or "update_id" not in update:
+            WEBHOOK_UPDATES.inc(result="bad_request")
+            return web.Response(status=400)
+        if self._pending >= self.queue_size:
+            WEBHOOK_UPDATES.inc(result="overloaded")
+            logger.warning(f"Webhook queue is full, update {update['update_id']} rejected")
+            return web.Response(status=503)
+        self._enqueue(update)
+        WEBHOOK_UPDATES.inc(result="accepted")
+        return web.Response()
+
+    def _enqueue(self, update: Dict[str, Any]):
+        sender = update_sender(update)
+        # Обновления без отправителя ни от чего не зависят и обрабатываются независимо
+        key = sender if sender is not None else ("update", update["update_id"])
+        self._pending += 1
+        updates = self._senders.get(key)
+        if updates is not None:
+            # Отправитель уже ждет воркера или обрабатывается - обновление пойдет следом
+            updates.append(update)
+            return
+        self._senders[key] = deque((update,))
+        self._ready.put_nowait(key)
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            updates = self._senders[key]
+            update = updates.popleft()
+            started = time.perf_counter()
+            try:
+                await self.dispatcher.feed_raw_update(self.bot, update)
+            except Exception as e:
+                logger.exception(f"Failed to process update {update.get('update_id')}: {e!r}")
+            finally:
+                WEBHOOK_UPDATE_LATENCY.observe(time.perf_counter() - started)
+                self._pending -= 1
+                if updates:
+                    # Следующее обновление отправителя - в конец очереди, чтобы не обгонять других
+                    self._ready.put_nowait(key)
+                else:
+                    del self._senders[key]
+                self._ready.task_done()